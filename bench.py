@@ -0,0 +1,465 @@
+"""
+benchmarks of the hot paths of lazyclass and LazyDAG
+
+    python bench.py                     # run all the benchmarks
+    python bench.py -k diamond -o a.json
+    python bench.py compare a.json b.json
+
+results are written as JSON (with the commit and python version) after each
+benchmark, so that runs on different commits can be compared. times are per operation, the
+minimum and median of several repeats
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from lazydag import LazyDAG
+from lazydag.lazyclass import lazyclass
+
+#########################
+# region: graphs
+
+def _func(name, args, body):
+    namespace = {}
+    exec(f'def {name}({", ".join(args)}):\n    return {body}', namespace)
+    return namespace[name]
+
+def chain_class(n, slots=False, threadsafe=False, compiled=False, deferred=False):
+    """`v0` -> `v1` -> ... -> `v{n}`"""
+    namespace = {f'v{i}': _func(f'v{i}', [f'v{i-1}'], f'v{i-1} + 1') for i in range(1, n + 1)}
+    return lazyclass(type(f'Chain{n}', (), namespace), slots=slots, threadsafe=threadsafe,
+                     compiled=compiled, deferred=deferred)
+
+def fanout_class(n, slots=False, deferred=False):
+    """`v0` -> `v1`, `v2`, ... `v{n}`"""
+    namespace = {f'v{i}': _func(f'v{i}', ['v0'], f'v0 + {i}') for i in range(1, n + 1)}
+    return lazyclass(type(f'Fanout{n}', (), namespace), slots=slots, deferred=deferred)
+
+def diamond_class(n, compiled=False):
+    """layers of `width` vars, each one computed from two vars of the previous layer"""
+    width = max(2, int(n ** 0.5))
+    namespace = {}
+    for layer in range(1, n // width):
+        for i in range(width):
+            args = [f'v{layer-1}_{i}', f'v{layer-1}_{(i + 1) % width}']
+            namespace[f'v{layer}_{i}'] = _func(f'v{layer}_{i}', args, f'({args[0]} + {args[1]}) % 1000')
+    cls = lazyclass(type(f'Diamond{n}', (), namespace), compiled=compiled)
+    cls.inputs = [f'v0_{i}' for i in range(width)]
+    cls.output = f'v{n // width - 1}_0'
+    return cls
+
+def chain_dag(n):
+    """a LazyDAG of `n` vertices, each one computed from the two previous ones"""
+    dag = LazyDAG(v1=1)
+    for i in range(2, n):
+        dag.add_edge([f'v{i}'], lambda a, b: (a + b) % 1000, f'v{i-1}', f'v{i-2}')
+    return dag
+
+# endregion
+
+#########################
+# region: harness
+
+def timeit(func, repeat=5, min_time=0.05):
+    """the min and median time of a call to `func`, calibrated to run at least `min_time` per repeat"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {'unit': 's', 'min': min(times), 'median': statistics.median(times), 'number': number}
+
+def memory(func):
+    """the memory allocated and kept by `func()`, while its result is alive"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = func()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return {'unit': 'B', 'min': size, 'median': size, 'number': 1}
+
+BENCHMARKS = {}
+
+def benchmark(name, sizes):
+    def decorator(func):
+        for n in sizes:
+            BENCHMARKS[f'{name}[{n}]'] = (func, n)
+        return func
+    return decorator
+
+# endregion
+
+#########################
+# region: benchmarks
+
+@benchmark('lazyclass_first_get', [10, 100])
+def bench_first_get(n):
+    cls = chain_class(n)
+    name = f'v{n}'
+    return timeit(lambda: getattr(cls(v0=1), name))
+
+@benchmark('lazyclass_compiled_first_get', [10, 100])
+def bench_compiled_first_get(n):
+    cls = chain_class(n, compiled=True)
+    name = f'v{n}'
+    return timeit(lambda: getattr(cls(v0=1), name))
+
+@benchmark('lazyclass_threadsafe_first_get', [10, 100])
+def bench_threadsafe_first_get(n):
+    cls = chain_class(n, threadsafe=True)
+    name = f'v{n}'
+    return timeit(lambda: getattr(cls(v0=1), name))
+
+@benchmark('lazyclass_threaded_io_reads', [1, 4, 16])
+def bench_threaded_io_reads(n):
+    """64 funcs waiting 1 ms each (e.g. for I/O), read from `n` threads"""
+    from concurrent.futures import ThreadPoolExecutor
+    namespace = {f'v{i}': _func(f'v{i}', ['v0'], f'__import__("time").sleep(0.001) or v0 + {i}')
+                 for i in range(1, 65)}
+    cls = lazyclass(type('IO', (), namespace), threadsafe=True)
+    names = [f'v{i}' for i in range(1, 65)]
+    with ThreadPoolExecutor(n) as executor:
+        def run():
+            obj = cls(v0=1)
+            list(executor.map(lambda name: getattr(obj, name), names))
+        return timeit(run, repeat=3)
+
+@benchmark('lazyclass_cached_get', [10])
+def bench_cached_get(n):
+    obj = chain_class(n)(v0=1)
+    getattr(obj, f'v{n}')
+    return timeit(lambda: obj.v1)
+
+@benchmark('lazyclass_set_read_chain', [10, 100])
+def bench_set_read_chain(n):
+    obj = chain_class(n)(v0=1)
+    name = f'v{n}'
+    def run():
+        obj.set(v0=2)
+        getattr(obj, name)
+        obj.set(v0=1)
+        getattr(obj, name)
+    return timeit(run)
+
+@benchmark('lazyclass_compiled_set_read_chain', [10, 100])
+def bench_compiled_set_read_chain(n):
+    obj = chain_class(n, compiled=True)(v0=1)
+    name = f'v{n}'
+    def run():
+        obj.set(v0=2)
+        getattr(obj, name)
+        obj.set(v0=1)
+        getattr(obj, name)
+    return timeit(run)
+
+@benchmark('lazyclass_fanout_set_read', [10, 100, 1000])
+def bench_fanout(n):
+    obj = fanout_class(n)(v0=1)
+    names = [f'v{i}' for i in range(1, n + 1)]
+    def run():
+        obj.set(v0=2)
+        obj.compute(*names)
+    return timeit(run)
+
+@benchmark('lazyclass_multi_output_set_read', [10, 100])
+def bench_multi_output(n):
+    """`v0` -> `stable__moving`, with a chain of `n` vars after `stable`, which does not change"""
+    namespace = {f'v{i}': _func(f'v{i}', [f'v{i-1}'], f'v{i-1} + 1') for i in range(2, n + 1)}
+    namespace['v1'] = _func('v1', ['stable'], 'len(stable)')
+    namespace['stable__moving'] = _func('stable__moving', ['v0'], '(1, 2, 3), v0 + 1') # a constant tuple
+    obj = lazyclass(type(f'MultiOutput{n}', (), namespace))(v0=1)
+    names = [f'v{n}', 'moving']
+    def run():
+        obj.set(v0=2)
+        obj.compute(*names)
+        obj.set(v0=1)
+        obj.compute(*names)
+    return timeit(run)
+
+@benchmark('lazyclass_write_heavy', [10, 100, 1000])
+def bench_write_heavy(n, deferred=False):
+    """100 sets of `v0` for one read of `v1`, with `n` vars depending on `v0`"""
+    obj = fanout_class(n, deferred=deferred)(v0=1)
+    obj.compute(*[f'v{i}' for i in range(1, n + 1)])
+    def run():
+        for i in range(100):
+            obj.v0 = i
+        obj.v1
+    return timeit(run)
+
+@benchmark('lazyclass_deferred_write_heavy', [10, 100, 1000])
+def bench_deferred_write_heavy(n):
+    return bench_write_heavy(n, deferred=True)
+
+@benchmark('lazyclass_read_heavy', [10, 100])
+def bench_read_heavy(n, deferred=False):
+    """one set of `v0` for 100 reads of `v{n}`, at the end of a chain of `n` vars"""
+    obj = chain_class(n, deferred=deferred)(v0=1)
+    name = f'v{n}'
+    def run():
+        obj.v0 += 1
+        for _ in range(100):
+            getattr(obj, name)
+    return timeit(run)
+
+@benchmark('lazyclass_deferred_read_heavy', [10, 100])
+def bench_deferred_read_heavy(n):
+    return bench_read_heavy(n, deferred=True)
+
+@benchmark('lazyclass_diamond_set_all_read', [100, 1000])
+def bench_diamond_set_all(n):
+    cls = diamond_class(n)
+    obj = cls(**dict.fromkeys(cls.inputs, 1))
+    getattr(obj, cls.output)
+    inputs = [dict.fromkeys(cls.inputs, i) for i in (1, 2)]
+    def run():
+        for values in inputs:
+            obj.set(**values)
+            getattr(obj, cls.output)
+    return timeit(run)
+
+@benchmark('lazyclass_diamond_first_get', [10, 100, 1000, 10000])
+def bench_diamond(n, compiled=False):
+    cls = diamond_class(n, compiled)
+    inputs = dict.fromkeys(cls.inputs, 1)
+    return timeit(lambda: getattr(cls(**inputs), cls.output), repeat=3)
+
+@benchmark('lazyclass_compiled_diamond_first_get', [10, 100, 1000, 10000])
+def bench_compiled_diamond(n):
+    return bench_diamond(n, compiled=True)
+
+@benchmark('lazyclass_instance_memory', [100, 1000])
+def bench_instance_memory(n, slots=False):
+    cls = fanout_class(n, slots)
+    def run():
+        obj = cls(v0=1)
+        obj.compute(*[f'v{i}' for i in range(1, n + 1)])
+        return obj
+    return memory(run)
+
+@benchmark('lazyclass_slots_instance_memory', [10, 100])
+def bench_slots_instance_memory(n):
+    return bench_instance_memory(n, slots=True)
+
+@benchmark('lazyclass_many_instances_memory', [10000])
+def bench_many_instances_memory(n, slots=False):
+    cls = chain_class(3, slots)
+    def run():
+        objs = [cls(v0=i) for i in range(n)]
+        for obj in objs:
+            obj.v3
+        return objs
+    return memory(run)
+
+@benchmark('lazyclass_slots_many_instances_memory', [10000])
+def bench_slots_many_instances_memory(n):
+    return bench_many_instances_memory(n, slots=True)
+
+@benchmark('lazyclass_decorate', [100, 1000])
+def bench_decorate(n):
+    namespace = {f'v{i}': _func(f'v{i}', [f'v{i-1}'], f'v{i-1} + 1') for i in range(1, n + 1)}
+    return timeit(lambda: lazyclass(type('Chain', (), dict(namespace))), repeat=3)
+
+@benchmark('lazydag_call', [10, 100, 1000])
+def bench_dag_call(n):
+    dag = chain_dag(n)
+    dag(v0=1).v2
+    return timeit(lambda: dag(v0=1))
+
+@benchmark('lazydag_call_read', [10, 100])
+def bench_dag_call_read(n):
+    dag = chain_dag(n)
+    name = f'v{n - 1}'
+    return timeit(lambda: getattr(dag(v0=1), name))
+
+@benchmark('lazydag_shared_call_read', [10, 100])
+def bench_dag_shared_call_read(n):
+    """as `lazydag_call_read`, with the values shared by the instances"""
+    dag = chain_dag(n).share()
+    name = f'v{n - 1}'
+    return timeit(lambda: getattr(dag(v0=1), name))
+
+@benchmark('lazydag_overlap', [10, 100])
+def bench_dag_overlap(n, shared=False):
+    """
+    10 instances differing by the input `x` of the last vertex, after a
+    chain of `n` vertices and a slow one (0.1 ms) which they have in common
+    """
+    def slow(chain, v0):
+        time.sleep(1e-4)
+        return chain + v0
+    dag = chain_dag(n)
+    dag.add_edge(['slow'], slow, f'v{n - 1}', 'v0')
+    dag.add_edge(['out'], lambda slow, x: slow + x, 'slow', 'x')
+    if shared:
+        dag.share()
+    def run():
+        for x in range(10):
+            dag(v0=1, x=x).out
+    return timeit(run, repeat=3)
+
+@benchmark('lazydag_shared_overlap', [10, 100])
+def bench_dag_shared_overlap(n):
+    return bench_dag_overlap(n, shared=True)
+
+@benchmark('lazydag_compiled_call_compute', [10, 100])
+def bench_dag_compiled_call_compute(n):
+    dag = chain_dag(n)
+    name = f'v{n - 1}'
+    return timeit(lambda: dag(v0=1).compute(name, compiled=True))
+
+@benchmark('lazydag_instance_memory', [100, 1000])
+def bench_dag_memory(n):
+    dag = chain_dag(n)
+    dag(v0=1).v2
+    def run():
+        instance = dag(v0=1)
+        instance.v2
+        return instance
+    return memory(run)
+
+@benchmark('plan_build', [100, 1000, 10000])
+def bench_plan(n):
+    def run():
+        dag = chain_dag(n)
+        start = time.perf_counter()
+        dag._get_plan()
+        return time.perf_counter() - start
+    times = [run() for _ in range(3)]
+    return {'unit': 's', 'min': min(times), 'median': statistics.median(times), 'number': 1}
+
+_STARTUP_LAZYCLASS = '''
+import sys, time
+n = int(sys.argv[1])
+start = time.perf_counter()
+from lazydag.lazyclass import lazyclass
+elapsed = time.perf_counter() - start
+funcs = [] # the funcs of each level of a hierarchy
+for level in range(10):
+    namespace = {}
+    for i in range(5):
+        arg = f'v{level - 1}_{i}' if level else f'x{i}'
+        exec(f'def v{level}_{i}({arg}):\\n    return {arg} + 1', namespace)
+    funcs.append({k: v for k, v in namespace.items() if k.startswith('v')})
+start = time.perf_counter()
+for _ in range(n // 10):
+    base = object
+    for namespace in funcs:
+        base = lazyclass(type('A', (base,), dict(namespace)))
+print(elapsed + time.perf_counter() - start)
+'''
+
+_STARTUP_LAZYDAG = '''
+import time
+start = time.perf_counter()
+from lazydag import LazyDAG
+print(time.perf_counter() - start)
+'''
+
+def _startup(script, *args, repeat=5):
+    """the time printed by `script`, run in fresh interpreters"""
+    # run from the directory of `lazydag`, so that it is imported from anywhere
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    times = [float(subprocess.run([sys.executable, '-c', script, *map(str, args)], capture_output=True,
+                                  text=True, check=True, cwd=cwd).stdout) for _ in range(repeat)]
+    return {'unit': 's', 'min': min(times), 'median': statistics.median(times), 'number': 1}
+
+@benchmark('startup_lazyclass', [0, 100, 1000])
+def bench_startup_lazyclass(n):
+    """import lazyclass and decorate `n` lazyclasses, in hierarchies of 10 classes each adding 5 funcs"""
+    return _startup(_STARTUP_LAZYCLASS, n)
+
+@benchmark('startup_lazydag', [0])
+def bench_startup_lazydag(n):
+    """import LazyDAG"""
+    return _startup(_STARTUP_LAZYDAG)
+
+# endregion
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _format(result):
+    if 'error' in result:
+        return 'error'
+    if result['unit'] == 'B':
+        return f'{result["min"] / 1024:.1f} KB'
+    value = result['min']
+    for unit, scale in [('s', 1), ('ms', 1e-3), ('us', 1e-6), ('ns', 1e-9)]:
+        if value >= scale:
+            break
+    return f'{value / scale:.2f} {unit}'
+
+def run(pattern=None, output=None):
+    """
+    run the benchmarks, writing the results after each one. a benchmark
+    raising an error is recorded as `{'error': ...}` and the others still run
+    """
+    results = {}
+    report = {
+        'meta': {'commit': _commit(), 'python': sys.version.split()[0],
+                 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': results,
+    }
+    for name, (func, n) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        try:
+            results[name] = func(n)
+        except Exception as e:
+            results[name] = {'error': repr(e)}
+        print(f'{name:<40} {_format(results[name]):>12}', flush=True)
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=1)
+    return report
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f'{"":<40} {os.path.basename(old_path):>12} {os.path.basename(new_path):>12} {"ratio":>8}')
+    for name, result in new['results'].items():
+        if name in old['results']:
+            before = old['results'][name]
+            if 'error' in before or 'error' in result or not before['min']:
+                ratio = float('nan')
+            else:
+                ratio = result['min'] / before['min']
+            print(f'{name:<40} {_format(before):>12} {_format(result):>12} {ratio:>8.2f}')
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['compare']:
+        parser = argparse.ArgumentParser(prog='bench.py compare')
+        parser.add_argument('old')
+        parser.add_argument('new')
+        args = parser.parse_args(sys.argv[2:])
+        compare(args.old, args.new)
+    else:
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-k', dest='pattern', help='only run the benchmarks whose name contains this')
+        parser.add_argument('-o', dest='output', help='write the results to this JSON file')
+        args = parser.parse_args()
+        run(args.pattern, args.output)
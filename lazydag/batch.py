@@ -0,0 +1,68 @@
+from .plan import Plan, _is_async
+
+def vectorized(func):
+    """mark `func` as working on whole columns, so that `LazyDAG.map` calls it once per batch"""
+    try:
+        func._lazydag_vectorized = True
+    except AttributeError:
+        # e.g. builtins and numpy ufuncs
+        inner = func
+        def func(*args, **kwargs):
+            return inner(*args, **kwargs)
+        func.__name__ = getattr(inner, '__name__', func.__name__)
+        func._lazydag_vectorized = True
+    return func
+
+def _is_vectorized(func):
+    return getattr(func, '_lazydag_vectorized', False)
+
+def _batched(func, n_returns, args_mask, kwargs_mask):
+    """call a scalar `func` once per row of its column args, and return its results as columns"""
+    def rows(args, kwargs):
+        columns = [arg for arg, is_column in zip(args, args_mask) if is_column]
+        columns += [kwargs[k] for k, is_column in kwargs_mask.items() if is_column]
+        for i in range(len(columns[0])):
+            yield ([arg[i] if is_column else arg for arg, is_column in zip(args, args_mask)],
+                   {k: v[i] if kwargs_mask[k] else v for k, v in kwargs.items()})
+
+    def columns(ret):
+        if n_returns == 1:
+            return ret
+        return tuple(list(column) for column in zip(*ret)) if ret else tuple([] for _ in range(n_returns))
+
+    if _is_async(func):
+        async def batched(*args, **kwargs):
+            import asyncio
+            return columns(await asyncio.gather(*[func(*a, **k) for a, k in rows(args, kwargs)]))
+    else:
+        def batched(*args, **kwargs):
+            return columns([func(*a, **k) for a, k in rows(args, kwargs)])
+    batched.__name__ = func.__name__
+    return batched
+
+def batch_plan(plan, columns):
+    """
+    derive a plan evaluating `plan` on columns bound to the vars `columns`
+
+    the nodes depending on a column return columns: vectorized funcs are
+    called once with the columns, the other ones once per row
+    """
+    key = ('batch', frozenset(columns))
+    if key in plan.derived:
+        return plan.derived[key]
+    column_vars = plan.descendants(columns)
+
+    other = Plan()
+    for name, default, eq in zip(plan.names, plan.defaults, plan.eqs):
+        other.add_var(name, default, eq)
+    for node in plan.nodes:
+        func = node.func
+        args_mask = [var in column_vars for var in node.args]
+        kwargs_mask = {k: var in column_vars for k, var in node.kwargs}
+        if not _is_vectorized(func) and (any(args_mask) or any(kwargs_mask.values())):
+            func = _batched(func, len(node.returns), args_mask, kwargs_mask)
+        other.add_node([plan.names[var] for var in node.returns], func,
+                       *[plan.names[var] for var in node.args],
+                       **{k: plan.names[var] for k, var in node.kwargs})
+    plan.derived[key] = other.compile()
+    return plan.derived[key]
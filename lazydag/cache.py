@@ -0,0 +1,329 @@
+import abc
+import functools
+import hashlib
+import inspect
+import itertools
+import os
+import pickle
+import sys
+import textwrap
+import threading
+import time
+from collections import OrderedDict
+
+from . import plan as _plan
+from .plan import Empty
+
+def sizeof(value):
+    """the size of a value in bytes, counting the buffers of arrays"""
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+def func_hash(func, version=None):
+    """a hash of `func`, from its `version` if given, or else from its source"""
+    func = inspect.unwrap(func)
+    h = hashlib.blake2b(f'{func.__module__}.{func.__qualname__}'.encode(), digest_size=20)
+    if version is not None:
+        h.update(repr(version).encode())
+    else:
+        try:
+            h.update(textwrap.dedent(inspect.getsource(func)).encode())
+        except (OSError, TypeError):
+            code = func.__code__
+            h.update(code.co_code)
+            h.update(repr(code.co_consts).encode())
+    return h.hexdigest()
+
+def value_hash(*values):
+    """
+    a hash of picklable values, whose buffers (e.g. of NumPy arrays) are hashed
+    without being copied
+    """
+    buffers = []
+    data = pickle.dumps(values, protocol=5, buffer_callback=buffers.append)
+    h = hashlib.blake2b(data, digest_size=20)
+    for buffer in buffers:
+        h.update(buffer.raw())
+    return h.hexdigest()
+
+class Cache(abc.ABC):
+    """the base class of caches, counting their hits and misses"""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abc.abstractmethod
+    def get(self, key):
+        """the value of `key`, or `Empty`"""
+
+    @abc.abstractmethod
+    def put(self, key, value):
+        pass
+
+    def _count(self, value):
+        if value is Empty:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+class MemoryCache(Cache):
+    """a LRU cache in memory, evicting values above `max_bytes` or older than `max_age` seconds"""
+    def __init__(self, max_bytes=None, max_age=None):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.nbytes = 0
+        self._items = OrderedDict() # key -> (value, size, time)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and self.max_age is not None and time.time() - item[2] > self.max_age:
+                self._pop(key)
+                item = None
+            if item is None:
+                return self._count(Empty)
+            self._items.move_to_end(key)
+            return self._count(item[0])
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+            self._items[key] = (value, size, time.time())
+            self.nbytes += size
+            self._evict()
+
+    def _pop(self, key):
+        _, size, _ = self._items.pop(key)
+        self.nbytes -= size
+
+    def _evict(self):
+        now = time.time()
+        while self._items:
+            key, (_, _, t) = next(iter(self._items.items()))
+            if ((self.max_bytes is not None and self.nbytes > self.max_bytes)
+                or (self.max_age is not None and now - t > self.max_age)):
+                self._pop(key)
+            else:
+                break
+
+class DirectoryCache(Cache):
+    """
+    a cache in a local directory, shared between processes
+
+    NumPy arrays are stored as `.npy` files and loaded memory-mapped, other
+    values are pickled. files above `max_bytes` in total or older than
+    `max_age` seconds are evicted, least recently used first. the directory
+    is only scanned when the size of the files put since the last scan
+    exceeds `max_bytes`, or `max_age` after it, so the files put by other
+    processes are only counted then
+    """
+    def __init__(self, path, max_bytes=None, max_age=None):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.nbytes = None   # the size of the files at the last scan, and of the ones put since
+        self._scanned = None # the time of the last scan
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _files(self, key):
+        return os.path.join(self.path, key + '.npy'), os.path.join(self.path, key + '.pkl')
+
+    def get(self, key):
+        for filename in self._files(key):
+            try:
+                mtime = os.path.getmtime(filename)
+            except OSError:
+                continue
+            if self.max_age is not None and time.time() - mtime > self.max_age:
+                self._remove(filename)
+                break
+            try:
+                os.utime(filename)
+                if filename.endswith('.npy'):
+                    import numpy
+                    return self._count(numpy.load(filename, mmap_mode='r'))
+                with open(filename, 'rb') as f:
+                    return self._count(pickle.load(f))
+            except OSError:
+                # evicted by another process since
+                continue
+        return self._count(Empty)
+
+    def put(self, key, value):
+        npy, pkl = self._files(key)
+        numpy = sys.modules.get('numpy')
+        is_array = numpy is not None and type(value) is numpy.ndarray and value.dtype != object
+        filename = npy if is_array else pkl
+        tmp = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            if is_array:
+                numpy.save(f, value)
+            else:
+                pickle.dump(value, f, protocol=5)
+            size = f.tell()
+        os.replace(tmp, filename)
+        if self.max_bytes is None and self.max_age is None:
+            return
+        with self._lock:
+            if self.nbytes is not None:
+                self.nbytes += size
+            if (self.nbytes is None or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+                or (self.max_age is not None and time.time() - self._scanned > self.max_age)):
+                self._evict()
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def _evict(self):
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(('.npy', '.pkl')):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        now = time.time()
+        for mtime, size, filename in files:
+            if ((self.max_bytes is not None and total > self.max_bytes)
+                or (self.max_age is not None and now - mtime > self.max_age)):
+                self._remove(filename)
+                total -= size
+            else:
+                break
+        self.nbytes = total
+        self._scanned = now
+
+def cached(cache, version=None):
+    """
+    memoize a node func in `cache`, keyed by the hash of the func (see
+    `func_hash`) and of its args. values which can not be pickled are not cached
+
+        @lazyclass
+        class A:
+            @cached(DirectoryCache('/tmp/features'))
+            def features(image):
+                ...
+    """
+    def decorator(func):
+        prefix = func_hash(func, version)
+        def key(args, kwargs):
+            try:
+                return prefix + value_hash(args, sorted(kwargs.items()))
+            except (pickle.PicklingError, TypeError, AttributeError):
+                return None
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                k = key(args, kwargs)
+                value = Empty if k is None else cache.get(k)
+                if value is Empty:
+                    value = await func(*args, **kwargs)
+                    if k is not None:
+                        cache.put(k, value)
+                elif _plan._profiler is not None:
+                    _plan._profiler.cache_hit()
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                k = key(args, kwargs)
+                value = Empty if k is None else cache.get(k)
+                if value is Empty:
+                    value = func(*args, **kwargs)
+                    if k is not None:
+                        cache.put(k, value)
+                elif _plan._profiler is not None:
+                    _plan._profiler.cache_hit()
+                return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+class SharedValues:
+    """
+    a table of the values computed by the instances of a `LazyDAG`, so that
+    the instances with the same inputs share their computations, see
+    `LazyDAG.share`. the values must not be changed in place
+
+    each value is given an id, and the values returned by a func are keyed by
+    the func and the ids of its args (hash-consing), so that a key stays
+    small whatever the number of funcs before it. an input is identified by
+    its name and value, or by its identity if it is not hashable. the entries
+    are kept in `cache` (by default a `MemoryCache` of 256 MB), the least
+    recently used being evicted
+    """
+    def __init__(self, cache=None):
+        self.cache = MemoryCache(max_bytes=256 << 20) if cache is None else cache
+        self._funcs = {} # (func, kwargs names) -> its id
+        self._nodes = {} # `Node` -> the id of its func
+        self._ids = itertools.count()
+
+    def _var_id(self, state, var):
+        """the id of the value of a var in a `State`"""
+        value = state.values[var]
+        item = state.ids.get(var)
+        if item is not None and item[1] is value:
+            return item[0]
+        plan = state.plan
+        if plan.producers[var] is None:
+            key = ('input', plan.names[var], type(value), value)
+            try:
+                hash(key)
+            except TypeError:
+                key = ('input', plan.names[var], 'id', id(value)) # kept alive by its entry
+            item = self.cache.get(key)
+            if item is Empty:
+                item = (next(self._ids), value)
+                self.cache.put(key, item)
+        else:
+            item = (next(self._ids), value) # not computed with this table, e.g. loaded
+        state.ids[var] = item
+        return item[0]
+
+    def lookup(self, state, node):
+        """the key of a node in a `State`, and its returns if they are in the table, or else `Empty`"""
+        func_id = self._nodes.get(node)
+        if func_id is None:
+            # the same func with the same kwargs names, e.g. in another template
+            sig = (node.func, tuple(k for k, _ in node.kwargs))
+            func_id = self._nodes[node] = self._funcs.setdefault(sig, next(self._ids))
+        key = (func_id, *[self._var_id(state, var) for var in node.args],
+               *[self._var_id(state, var) for _, var in node.kwargs])
+        item = self.cache.get(key)
+        if item is Empty:
+            return key, Empty
+        ids, ret = item
+        self._record(state, node, ids, ret)
+        return key, ret
+
+    def store(self, state, node, key, ret):
+        ids = tuple(next(self._ids) for _ in node.returns)
+        self.cache.put(key, (ids, ret))
+        self._record(state, node, ids, ret)
+
+    def _record(self, state, node, ids, ret):
+        for var, id_, value in zip(node.returns, ids, [ret] if len(node.returns) == 1 else ret):
+            state.ids[var] = (id_, value)
@@ -0,0 +1,118 @@
+"""
+specialized evaluators of a `Plan`, generated as straight-line python code
+
+    evaluate = plan.evaluator()
+    evaluate(state, (var,)) # compute `var` in a `State`
+
+each node gets a generated function, with the var indices as constants and
+its func as a local name, which first brings its dirty args up to date by
+calling the functions of their nodes, and keeps the semantics of
+`State._update`: the node is only run if one of its args changed since its
+returns were verified. so the clean part of the graph is skipped. the nodes
+too deep to be reached by recursion are run in topological order instead,
+see `State._collect`. the functions are generated once per plan (see
+`Plan.evaluator`), so it is worth it for the graphs evaluated many times
+"""
+import keyword
+
+from .plan import Empty
+
+# the depth of the nodes computed by recursion, below the recursion limit
+_MAX_DEPTH = 200
+
+def _depths(plan):
+    """node -> the length of the longest path of nodes ending with it"""
+    depths = [0] * len(plan.nodes)
+    for n in sorted(range(len(plan.nodes)), key=plan.positions.__getitem__):
+        producers = [plan.producers[var] for var in plan._node_args(n)]
+        depths[n] = 1 + max((depths[p] for p in producers if p is not None), default=0)
+    return depths
+
+def _call(node, n):
+    args = [f'values[{var}]' for var in node.args]
+    kwargs = [(k, f'values[{var}]') for k, var in node.kwargs]
+    if all(k.isidentifier() and not keyword.iskeyword(k) for k, _ in kwargs):
+        args += [f'{k}={value}' for k, value in kwargs]
+    elif kwargs:
+        args.append('**{' + ', '.join(f'{k!r}: {value}' for k, value in kwargs) + '}')
+    return f'f{n}({", ".join(args)})'
+
+def _node_lines(plan, n):
+    node = plan.nodes[n]
+    returns = node.returns
+    first = returns[0]
+    args = sorted(set(plan._node_args(n)))
+    lines = [f'def n{n}(values, changed, verified, dirty, revision):']
+    lines.append(f'    # {"__".join(plan.names[var] for var in returns)}')
+    for var in args:
+        producer = plan.producers[var]
+        if producer is not None:
+            lines.append(f'    if values[{var}] is Empty or {var} in dirty:')
+            lines.append(f'        n{producer}(values, changed, verified, dirty, revision)')
+    # its args did not change since it was verified
+    fresh = [f'values[{var}] is not Empty' for var in returns]
+    fresh += [f'changed[{var}] <= verified[{first}]' for var in args]
+    lines.append('    if ' + ' and '.join(fresh) + ':')
+    for var in returns:
+        lines.append(f'        verified[{var}] = revision')
+    lines.append('        if dirty:')
+    lines += [f'            dirty.discard({var})' for var in returns]
+    lines.append('        return')
+    for var in args:
+        if plan.producers[var] is None:
+            lines.append(f'    if values[{var}] is Empty: missing({var})')
+    if node.is_async:
+        lines.append(f'    nodes[{n}]._check_sync(plan)')
+    lines.append(f'    ret = {_call(node, n)}')
+    for i, var in enumerate(returns):
+        value = 'ret' if len(returns) == 1 else f'ret[{i}]'
+        if plan.eqs[var] is not None:
+            lines.append(f'    if values[{var}] is Empty or not eq{var}(values[{var}], {value}):')
+            lines.append(f'        values[{var}] = {value}')
+            lines.append(f'        changed[{var}] = revision')
+        else:
+            lines.append(f'    values[{var}] = {value}')
+            lines.append(f'    changed[{var}] = revision')
+        lines.append(f'    verified[{var}] = revision')
+    lines.append('    if dirty:')
+    lines += [f'        dirty.discard({var})' for var in returns]
+    return lines
+
+def generate(plan):
+    """a function computing vars in a `State` of `plan`, with the code of its nodes as `source`"""
+    lines = ['def make(plan, funcs, eqs, Empty, missing):']
+    lines.append('    nodes = plan.nodes')
+    for n, node in enumerate(plan.nodes):
+        lines.append(f'    f{n} = funcs[{n}]')
+        for var in node.returns:
+            if plan.eqs[var] is not None:
+                lines.append(f'    eq{var} = eqs[{var}]')
+    for n in range(len(plan.nodes)):
+        lines += ['    ' + line for line in _node_lines(plan, n)]
+    lines.append('    return [' + ', '.join(f'n{n}' for n in range(len(plan.nodes))) + ']')
+    source = '\n'.join(lines)
+
+    def missing(var):
+        raise AttributeError(f'value and func not set for var `{plan.names[var]}`')
+    namespace = {}
+    exec(compile(source, '<lazydag evaluator>', 'exec'), namespace)
+    steps = namespace['make'](plan, [node.func for node in plan.nodes], plan.eqs, Empty, missing)
+    producers, depths, position = plan.producers, _depths(plan), plan.positions.__getitem__
+
+    def evaluate(state, vars):
+        values, dirty = state.values, state.dirty
+        for var in vars:
+            if values[var] is not Empty and var not in dirty:
+                continue
+            node = producers[var]
+            if node is None:
+                missing(var)
+            args = values, state.changed, state.verified, dirty, state.revision
+            if depths[node] <= _MAX_DEPTH:
+                steps[node](*args)
+            else:
+                pending, _ = state._collect((var,))
+                for node in sorted(pending, key=position):
+                    steps[node](*args)
+    evaluate.source = source
+    return evaluate
@@ -0,0 +1,171 @@
+"""
+inspection of the graph of a lazyclass (class or instance) or of a LazyDAG,
+without running it
+
+    print(to_dot(A, stats=profiler))   # the critical path is drawn in red
+    invalidates(obj, 'a')              # the vars a `set(a=...)` would invalidate
+    computes(obj, 'e')                 # the funcs a read of `e` would run
+"""
+import json
+
+from .plan import Empty
+
+def _resolve(obj):
+    """the plan of `obj`, and its state if it is an instance"""
+    from . import LazyDAG
+    from .lazyclass import _get_plan, _get_state
+    if isinstance(obj, LazyDAG):
+        state = obj._get_state()
+        return state.plan, state
+    if isinstance(obj, type):
+        return _get_plan(obj), None
+    state = _get_state(obj)
+    return state.plan, state
+
+def _node_name(plan, node):
+    return '__'.join(plan.names[var] for var in plan.nodes[node].returns)
+
+def _times(plan, stats):
+    """node -> seconds per run, from a `Profiler`, its stats, or a dict name -> seconds"""
+    from .profile import Profiler
+    stats = getattr(stats, 'stats', stats) or {}
+    times = {}
+    for node in range(len(plan.nodes)):
+        # the stats of a profiler are keyed by the func of the node too
+        s = stats.get(Profiler.key(plan, plan.nodes[node]))
+        if s is None:
+            s = stats.get(_node_name(plan, node))
+        if s is None:
+            continue
+        if hasattr(s, 'wall'):
+            s = s.wall / s.calls if s.calls else 0.
+        times[node] = s
+    return times
+
+def depths(obj):
+    """var name -> the length of the longest chain of funcs computing it (0 for inputs)"""
+    plan, _ = _resolve(obj)
+    depth = [0] * len(plan.names)
+    for node in plan.order:
+        d = 1 + max((depth[var] for var in plan._node_args(node)), default=0)
+        for var in plan.nodes[node].returns:
+            depth[var] = d
+    return dict(zip(plan.names, depth))
+
+def critical_path(obj, stats):
+    """
+    the slowest chain of funcs, as `(seconds, [func names])`, from the times
+    of a `lazydag.profile.Profiler` (or a dict func name -> seconds)
+    """
+    plan, _ = _resolve(obj)
+    times = _times(plan, stats)
+    total = {}    # node -> time of the slowest chain ending with it
+    previous = {} # node -> the node before it in that chain
+    for node in plan.order:
+        total[node] = times.get(node, 0.)
+        for var in plan._node_args(node):
+            producer = plan.producers[var]
+            if producer is not None and total[producer] + times.get(node, 0.) > total[node]:
+                total[node] = total[producer] + times.get(node, 0.)
+                previous[node] = producer
+    if not total:
+        return 0., []
+    node = max(total, key=total.__getitem__)
+    seconds = total[node]
+    path = [node]
+    while path[-1] in previous:
+        path.append(previous[path[-1]])
+    return seconds, [_node_name(plan, node) for node in reversed(path)]
+
+def invalidates(obj, *names):
+    """
+    the vars a `set()` of `names` would invalidate: for an instance, the ones
+    computed and not already invalidated, or else all the ones depending on them
+    (as for a deferred instance, which only invalidates them when they are read)
+    """
+    plan, state = _resolve(obj)
+    vars = [plan.index[name] for name in names]
+    if state is None or state.deferred:
+        return sorted((plan.names[var] for var in plan.descendants(vars) - set(vars)), key=plan.index.get)
+    # as in `State.update`
+    ret = set()
+    stack = list(vars)
+    while stack:
+        for node in plan.consumers[stack.pop()]:
+            for var in plan.nodes[node].returns:
+                if var not in ret and (state.values[var] is not Empty and var not in state.dirty
+                                       or var in (state.freed or ())):
+                    ret.add(var)
+                    stack.append(var)
+    return sorted((plan.names[var] for var in ret), key=plan.index.get)
+
+def computes(obj, *names):
+    """
+    the funcs a read of `names` would run, in order: for an instance, the
+    ones not computed or invalidated (which may be found unchanged), or else all of them
+    """
+    plan, state = _resolve(obj)
+    nodes = set()
+    stack = [plan.index[name] for name in names]
+    while stack:
+        var = stack.pop()
+        if state is not None and state.values[var] is not Empty and var not in state.dirty:
+            continue
+        node = plan.producers[var]
+        if node is not None and node not in nodes:
+            nodes.add(node)
+            stack.extend(plan._node_args(node))
+    return [_node_name(plan, node) for node in sorted(nodes, key=plan.positions.__getitem__)]
+
+def to_dict(obj, stats=None):
+    """the graph as a JSON-serializable dict of vars and funcs, with their times if `stats` are given"""
+    plan, _ = _resolve(obj)
+    depth = depths(obj)
+    times = _times(plan, stats)
+    vars = [{'name': name, 'input': plan.producers[var] is None, 'depth': depth[name],
+             'consumers': sorted({_node_name(plan, node) for node in plan.consumers[var]})}
+            for var, name in enumerate(plan.names)]
+    nodes = []
+    for node in plan.order:
+        n = plan.nodes[node]
+        func = getattr(n.func, '__qualname__', repr(n.func))
+        nodes.append({
+            'name': _node_name(plan, node), 'func': f'{getattr(n.func, "__module__", "")}.{func}',
+            'returns': [plan.names[var] for var in n.returns],
+            'args': [plan.names[var] for var in n.args],
+            'kwargs': {k: plan.names[var] for k, var in n.kwargs},
+            'depth': depth[plan.names[n.returns[0]]],
+            'fan_in': len(set(plan._node_args(node))),
+            'time': times.get(node),
+        })
+    ret = {'vars': vars, 'nodes': nodes}
+    if times:
+        ret['critical_path'] = dict(zip(['seconds', 'funcs'], critical_path(obj, stats)))
+    return ret
+
+def to_json(obj, stats=None, **kwargs):
+    return json.dumps(to_dict(obj, stats), **kwargs)
+
+def to_dot(obj, stats=None):
+    """the graph in the DOT language of Graphviz, with vars as ellipses and funcs as boxes"""
+    plan, _ = _resolve(obj)
+    times = _times(plan, stats)
+    critical = set(critical_path(obj, stats)[1]) if times else set()
+    lines = ['digraph lazydag {', '    rankdir=LR;', '    node [fontname="Helvetica"];']
+    for var, name in enumerate(plan.names):
+        shape = 'ellipse' if plan.producers[var] is None else 'ellipse, style=filled, fillcolor="#eeeeee"'
+        lines.append(f'    "{name}" [shape={shape}];')
+    for node in plan.order:
+        name = _node_name(plan, node)
+        label = name if node not in times else f'{name}\\n{times[node] * 1e3:.3g} ms'
+        color = ', color=red' if name in critical else ''
+        lines.append(f'    "func:{name}" [shape=box, label="{label}"{color}];')
+        n = plan.nodes[node]
+        for var in n.args:
+            lines.append(f'    "{plan.names[var]}" -> "func:{name}"{color and " [color=red]"};')
+        for k, var in n.kwargs:
+            lines.append(f'    "{plan.names[var]}" -> "func:{name}" [label="{k}"{color}];')
+        for var in n.returns:
+            lines.append(f'    "func:{name}" -> "{plan.names[var]}"{color and " [color=red]"};')
+    lines.append('}')
+    return '\n'.join(lines)
@@ -1,108 +1,11 @@
-import inspect
 from collections import defaultdict
-from typing import Any
+from types import FunctionType
 
-class Empty:
-    pass
-class LazyVariable:
-    __slots__ = ['name', '_value', '_func', '_successors', '_predecessors']
-    def __init__(self, name, value=Empty, func=Empty):
-        self.name = name
-        self._value = value
-        self._func = func
-        self._successors = set()
-        self._predecessors = set()
-
-    def _set_func(self, func: 'LazyFunction'):
-        if self._func is not Empty:
-            raise RuntimeError('func already set')
-        self._func = func
-    
-    def _set_value(self, value: Any):
-        if self._func is not Empty:
-            raise RuntimeError(
-                f'can not set value to a var {self.name} whose func already set')
-        self._value = value
-        # make all sucessors `dirty`
-        for successor in self._successors:
-            successor._value = Empty
-    
-    def _set_returned_value(self, value: Any) -> None:
-        if self._value is not Empty:
-            raise RuntimeError('value already set')
-        self._value = value
-    
-    def _is_reachable(self):
-        if self._value is not Empty:
-            return True
-        if self._func is Empty:
-            return False
-        return self._func._is_reachable()
-    
-    @property
-    def value(self):
-        if self._value is Empty:
-            if self._func is Empty:
-                raise AttributeError(f'value and func not set for var `{self.name}`')
-            self._func()
-        if self._value is Empty:
-            raise RuntimeError('value still not set after func call')
-        return self._value
-
-class LazyFunction:
-    __slots__ = ['return_values', 'func', 'args', 'kwargs']
-    def __init__(self, return_values, func, *args, **kwargs):
-        self.return_values = return_values
-        self.func = func
-        self.args = args
-        self.kwargs = kwargs
-        for value in self.return_values:
-            value._set_func(self)
-        
-        all_predecessors = self._all_predecessors()
-        all_successors = self._all_successors()
-        #print('all_predecessors', [v.name for v in all_predecessors])
-        #print('all_successors', [v.name for v in all_successors])
-
-        # check for cycles
-        inter = all_predecessors & all_successors
-        if inter:
-            names = [v.name for v in inter]
-            raise RuntimeError('cycle detected for variables: ' + ', '.join(names))
-
-        # propagate predecessors and successors
-        for predecessor in all_predecessors:
-            for successor in all_successors:
-                predecessor._successors.add(successor)
-                successor._predecessors.add(predecessor)
+from .plan import Empty, Plan, State, func_args
 
-    
-    def _all_predecessors(self):
-        ret = set(self.args)
-        ret |= set(self.kwargs.values())
-        for arg in self.args:
-            ret |= set(arg._predecessors)
-        for value in self.kwargs.values():
-            ret |= set(value._predecessors)
-        return ret
-
-    def _all_successors(self):
-        ret = set(self.return_values)
-        for value in self.return_values:
-            ret |= set(value._successors)
-        return ret
-
-    def __call__(self):
-        ret = self.func(*[value.value for value in self.args], 
-                         **{k:v.value for k, v in self.kwargs.items()})
-        if len(self.return_values) == 1:
-            ret = [ret]
-        for value, ret_value in zip(self.return_values, ret):
-            value._set_returned_value(ret_value)
-    
-    def _is_reachable(self):
-        return all(value._is_reachable() for value in self.args) and \
-               all(value._is_reachable() for value in self.kwargs.values())
+_PLAN = '__lazy_plan__'
+_STATE = '__lazy_state__'
+_OPTIONS = '__lazy_options__' # the options of the states of the instances, see `State`
 
 def _get_lazy_property(obj, key):
     for _class in type(obj).__mro__:
@@ -114,75 +17,195 @@ def _get_lazy_property(obj, key):
     else:
         raise AttributeError(f'attribute {key} not found')
 
+def _lazy_properties(cls):
+    """all the lazy properties of a class, as resolved by its mro"""
+    properties = {}
+    others = set()
+    for _class in cls.__mro__:
+        for key, value in _class.__dict__.items():
+            if key in properties or key in others:
+                continue
+            if isinstance(value, LazyProperty):
+                properties[key] = value
+            else:
+                others.add(key)
+    return properties, others
+
+def _compile_plan(cls):
+    """compile the lazy properties of a class into a `Plan` shared by all its instances"""
+    properties, others = _lazy_properties(cls)
+    plan = Plan()
+    for key, p in properties.items():
+        plan.add_var(key, p._default, p._eq)
+
+    # the funcs of the bases first, as the ones of a class usually use them,
+    # so that the nodes are mostly added in topological order
+    ordered = [p for _class in reversed(cls.__mro__) for key, p in _class.__dict__.items()
+               if isinstance(p, LazyProperty) and properties.get(key) is p]
+    funcs = set()
+    for p in ordered:
+        if p._func is Empty or p._func in funcs:
+            continue
+        funcs.add(p._func)
+        return_values = p._func.__name__.split('__')
+        args = func_args(p._func)
+        for arg in return_values + args:
+            if arg in others:
+                raise AttributeError(f'attribute {arg} is not a lazy property')
+            if arg not in properties:
+                raise AttributeError(f'attribute {arg} not found')
+        plan.add_node(return_values, p._func, *args)
+    return plan.compile()
+
+def _get_plan(cls):
+    plan = cls.__dict__.get(_PLAN)
+    if plan is None:
+        plan = _compile_plan(cls)
+        setattr(cls, _PLAN, plan)
+    return plan
+
+def _get_state(obj):
+    state = getattr(obj, _STATE, None)
+    if state is None:
+        cls = type(obj)
+        state = State(_get_plan(cls), **getattr(cls, _OPTIONS, {}))
+        if not state.deferred:
+            state.published = getattr(obj, '__dict__', None)
+        setattr(obj, _STATE, state)
+    return state
+
+def _updates(obj, updates):
+    """the updates of a stream (`(name, value)` or dicts), as lists of `(var, value)`"""
+    index = _get_state(obj).plan.index
+    for update in updates:
+        if isinstance(update, tuple):
+            update = [update]
+        elif isinstance(update, dict):
+            update = update.items()
+        yield [(index[_get_lazy_property(obj, k).name], v) for k, v in update]
+
+def _lazy_setattr(setattr_):
+    """route the assignments of lazy properties to them, as they are not data descriptors"""
+    def __setattr__(obj, name, value):
+        p = getattr(type(obj), name, None)
+        if isinstance(p, LazyProperty):
+            p._set_value(obj, value)
+        else:
+            setattr_(obj, name, value)
+    __setattr__._lazy = True
+    return __setattr__
+
 class LazyProperty(object):
-    __slots__ = ['name', '_func', '_name', '_default']
-    _NAME_PREFIX = '__lazy_'
-    def __init__(self, func=Empty, default=Empty):
+    """
+    a lazy property, computed by `func` from the lazy properties named by its args
+
+    with `eq` (`True` for `==`, or a function `eq(old, new)`), a new value
+    equal to the old one does not invalidate the properties depending on it.
+    for a func with several return values (`def c__b(a)`), `eq` can also be
+    a dict return name -> eq, and a return value without one is unchanged if
+    it is the same object as before
+
+    a computed value is also stored in the `__dict__` of the instance, so that
+    reading it again is a plain attribute lookup, until it is invalidated
+    """
+    __slots__ = ['name', '_func', '_default', '_eq']
+    def __init__(self, func=Empty, default=Empty, eq=None):
         self._func = func
         self._default = default
+        self._eq = eq
+
+    def __call__(self, func):
+        """allow `@LazyProperty(eq=True)` as a decorator"""
+        return type(self)(func, self._default, self._eq)
 
     def __set_name__(self, owner, name):
         self.name = name
-        self._name = self._NAME_PREFIX + name
-    
-    def _init_variable(self, obj):
-        if hasattr(obj, self._name):
-            return getattr(obj, self._name)
-        name = self.name
-        var = LazyVariable(name, value=self._default)
-        setattr(obj, self._name, var)
-        return var
-
-    def _init_property(self, obj):
-        var = self._init_variable(obj)
-        if self._func is not Empty:
-            # parse the function signature
-            import inspect
-            fullargspec = inspect.getfullargspec(self._func)
-            args = fullargspec.args
-
-            # make sure the return value is not in the args
-            if self.name in args:
-                func_str = f'{self._func.__name__}{str(inspect.signature(self._func))}'
-                raise RuntimeError(f'return value `{self.name}` in function {func_str} args')
-
-            # make sure all args are initialized
-            cls = type(obj)
-            for arg in args:
-                if not hasattr(obj, self._NAME_PREFIX + arg):
-                    obj._get_lazy_property(arg)._init_property(obj)
-            
-            return_values = self._func.__name__.split('__')
-            return_vars = [_get_lazy_property(obj, return_value)._init_variable(obj) for return_value in return_values]
-
-            # create a LazyFunction to calculate the value
-            args = [getattr(obj, self._NAME_PREFIX + arg) for arg in args]
-            #LazyFunction([var], self._func, *args)
-            LazyFunction(return_vars, self._func, *args)
+        if not getattr(owner.__setattr__, '_lazy', False):
+            owner.__setattr__ = _lazy_setattr(owner.__setattr__)
 
     def __get__(self, obj, objtype=None):
-        if not hasattr(obj, self._name):
-            self._init_property(obj)
-
-        return getattr(obj, self._name).value
+        # only called when the value is not in `obj.__dict__`
+        if obj is None:
+            return self
+        state = _get_state(obj)
+        var = state.plan.index[self.name]
+        value = state.get(var)
+        if state.published is not None:
+            if state.lock is None:
+                state.published[self.name] = value
+            else:
+                with state.lock:
+                    # unless it was set again meanwhile
+                    if state._is_clean(var) and state.values[var] is value:
+                        state.published[self.name] = value
+        return value
 
-    def __set__(self, obj, value):
-        if not hasattr(obj, self._name):
-            self._init_property(obj)
-        getattr(obj, self._name)._set_value(value)
-    
-    #def __delete__(self, obj):
-    #    pass
+    def _set_value(self, obj, value):
+        state = _get_state(obj)
+        state.set(state.plan.index[self.name], value)
 
 lazy_property = LazyProperty
 
+def _add_method(cls, name, method):
+    """add a method to a lazyclass, unless one of its lazy properties has the name"""
+    if not isinstance(getattr(cls, name, None), LazyProperty):
+        setattr(cls, name, method)
+
+def _with_slots(cls):
+    """recreate a class with `__slots__`, so that its instances only hold their state"""
+    namespace = dict(cls.__dict__)
+    namespace.pop('__dict__', None)
+    namespace.pop('__weakref__', None)
+    if any(_STATE in getattr(base, '__slots__', ()) for base in cls.__mro__[1:]):
+        namespace['__slots__'] = ()
+    else:
+        namespace['__slots__'] = (_STATE,)
+    new_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+    new_cls.__qualname__ = cls.__qualname__
+    # the zero-argument `super()` of the methods refers to the class in their `__class__` cell
+    for attr in new_cls.__dict__.values():
+        if isinstance(attr, (classmethod, staticmethod)):
+            attr = attr.__func__
+        funcs = [attr.fget, attr.fset, attr.fdel] if isinstance(attr, property) else [attr]
+        for func in funcs:
+            closure = getattr(func, '__closure__', None)
+            if closure is None or '__class__' not in func.__code__.co_freevars:
+                continue
+            cell = closure[func.__code__.co_freevars.index('__class__')]
+            if cell.cell_contents is cls:
+                cell.cell_contents = new_cls
+    return new_cls
+
+def lazyclass(cls=None, *, eq=None, slots=False, threadsafe=False, compiled=False, deferred=False):
+    """
+    turn the functions of a class into lazy properties, named by the functions
+    and computed from the lazy properties named by their args
+
+    `eq` is used by the lazy properties created here, see `LazyProperty`.
+    with `slots`, the instances have no `__dict__` and only hold their state
+    (so computed values are not read as plain attributes), which saves little
+    memory as the state is most of an instance. with `threadsafe`,
+    the instances can be shared by threads, and a func being run by one of
+    them is waited for by the others instead of being run again. with
+    `compiled`, the lazy properties are computed by functions generated for
+    their funcs once for the class (see `lazydag.codegen`).
+    with `deferred`, setting a lazy property takes the same time whatever the
+    number of lazy properties depending on it, which are verified when read
+    instead (and so are not read as plain attributes), see `State`
+
+    the methods `batch`, `compute`, `aget`, `stream` and `astream` are added
+    to the class, except the ones named as one of its lazy properties
+    """
+    if cls is None:
+        return lambda cls: lazyclass(cls, eq=eq, slots=slots, threadsafe=threadsafe,
+                                     compiled=compiled, deferred=deferred)
 
-def lazyclass(cls):
     # add lazy properties
     lazy_properties = defaultdict(dict)
 
     # deal with annotations
-    if hasattr(cls, '__annotations__'):
+    if cls.__dict__.get('__annotations__') or cls.__dict__.get('__annotate__'):
+        import inspect
         if hasattr(inspect, 'get_annotations'):
             annotations = inspect.get_annotations(cls)
         else:
@@ -199,11 +222,26 @@ def lazyclass(cls):
     # deal with super classes
     for sup in list(reversed(cls.__mro__)):
         for key, func in sup.__dict__.items():
-            if isinstance(func, LazyProperty):
+            if (key.startswith('__') and key.endswith('__')) or func is _get_lazy_property:
+                # e.g. the `__setattr__` of a lazyclass, inherited by another one
+                continue
+            if isinstance(func, LazyProperty) and '__' in key and func._func is not Empty:
+                # e.g. `@lazy_property(eq=True) def c__b(a)`, one lazy property per return value
+                for k in key.split('__'):
+                    lazy_properties[k]['func'] = func._func
+                    lazy_properties[k]['eq'] = func._eq.get(k) if isinstance(func._eq, dict) else func._eq
+                for arg in func_args(func._func):
+                    lazy_properties[arg]
+                if key in cls.__dict__:
+                    setattr(cls, key, func._func)
+            elif isinstance(func, LazyProperty):
                 lazy_properties[key]['super'] = True
-            elif inspect.isfunction(func):
-                fullargs = inspect.getfullargspec(func)
-                if (len(fullargs.args)>0) and (fullargs.args[0] == 'self'):
+                if func._func is not Empty:
+                    for arg in func_args(func._func):
+                        lazy_properties[arg]
+            elif isinstance(func, FunctionType):
+                args = func_args(func)
+                if (len(args)>0) and (args[0] == 'self'):
                     # this is an ordinary method
                     continue
                 else:
@@ -214,7 +252,7 @@ def lazyclass(cls):
                         keys = [key]
                     for key in keys:
                         lazy_properties[key]['func'] = func
-                    for arg in fullargs.args:
+                    for arg in args:
                         lazy_properties[arg]
             else:
                 pass
@@ -225,9 +263,9 @@ def lazyclass(cls):
         if hasattr(cls, k) and isinstance(getattr(cls, k), LazyProperty):
             continue
         if 'func' in v:
-            p = LazyProperty(v['func'])
+            p = LazyProperty(v['func'], eq=v.get('eq', eq))
         else:
-            p = LazyProperty(default=v.get('default', Empty))
+            p = LazyProperty(default=v.get('default', Empty), eq=eq)
         p.__set_name__(cls, k)
         setattr(cls, k, p)
     
@@ -235,15 +273,78 @@ def lazyclass(cls):
     setattr(cls, '_get_lazy_property', _get_lazy_property)
 
     def _set(self, **kwargs):
-        """this method is only used to set lazy properties"""
-        for k, v in kwargs.items():
-            self._get_lazy_property(k).__set__(self, v)
+        """set lazy properties at once, invalidating their successors in one pass"""
+        state = _get_state(self)
+        index = state.plan.index
+        state.update([(index[self._get_lazy_property(k).name], v) for k, v in kwargs.items()])
         return self
     setattr(cls, 'set', _set)
 
+    def _batch(self):
+        """
+        a context in which the lazy properties set are only set at its end, at once
+
+            with obj.batch():
+                obj.a = 1
+                obj.b = 2
+        """
+        return _get_state(self).batch()
+    _add_method(cls, 'batch', _batch)
+
+    def _compute(self, *names, executor=None, free=False, pin=(), compiled=None):
+        """compute several lazy properties at once, see `State.compute`"""
+        state = _get_state(self)
+        index = state.plan.index
+        return state.compute(*[index[self._get_lazy_property(k).name] for k in names],
+                             executor=executor, free=free,
+                             pin=[index[self._get_lazy_property(k).name] for k in pin],
+                             compiled=compiled)
+    _add_method(cls, 'compute', _compute)
+
+    async def _aget(self, name):
+        """await a lazy property, whose funcs may be coroutine functions"""
+        state = _get_state(self)
+        return await state.aget(state.plan.index[self._get_lazy_property(name).name])
+    _add_method(cls, 'aget', _aget)
+
+
+    def _stream(self, updates, names, coalesce=1):
+        """
+        set the lazy properties of each update (`(name, value)` or a dict),
+        and yield the ones of `names` whose values changed (compared with their
+        `eq`, or `==`), see `State.stream`
+
+            for changes in obj.stream(ticks, ['mid', 'spread']):
+                print(changes) # e.g. {'mid': 101.5}
+        """
+        state = _get_state(self)
+        vars = [state.plan.index[self._get_lazy_property(k).name] for k in names]
+        for changes in state.stream(_updates(self, updates), vars, coalesce):
+            yield {state.plan.names[var]: value for var, value in changes.items()}
+    _add_method(cls, 'stream', _stream)
+
+    async def _astream(self, updates, names, coalesce=1, latency=None):
+        """the async version of `stream`, for an async iterable of updates, see `State.astream`"""
+        state = _get_state(self)
+        vars = [state.plan.index[self._get_lazy_property(k).name] for k in names]
+        async def translated():
+            async for update in updates:
+                for items in _updates(self, [update]):
+                    yield items
+        async for changes in state.astream(translated(), vars, coalesce, latency):
+            yield {state.plan.names[var]: value for var, value in changes.items()}
+    _add_method(cls, 'astream', _astream)
 
     def __init__(self, **kwargs):
         self.set(**kwargs)
     setattr(cls, '__init__', __init__)
 
-    return cls
\ No newline at end of file
+    # compile the graph once for all instances
+    setattr(cls, _PLAN, _compile_plan(cls))
+    options = {k: True for k, v in [('threadsafe', threadsafe), ('compiled', compiled),
+                                    ('deferred', deferred)] if v}
+    if options:
+        setattr(cls, _OPTIONS, options)
+    if slots:
+        cls = _with_slots(cls)
+    return cls
@@ -0,0 +1,196 @@
+import dataclasses
+from dataclasses import dataclass
+
+from .dag import DAG, Vertex, Edge, keydefaultdict
+from .plan import Plan, State, func_args
+
+@dataclass
+class LazyVertex(Vertex):
+    def __hash__(self):
+        return hash(self.name)
+
+class FuncWrapper:
+    def __init__(self, return_values, func, *args, **kwargs):
+        self.return_values = return_values
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+@dataclass
+class LazyEdge(Edge):
+    func_wrapper : FuncWrapper = None
+
+class LazyDAG(DAG):
+    """
+    a DAG of lazy functions
+
+    calling a LazyDAG (`dag(b=4)`) creates an instance sharing its topology
+    and compiled `Plan`, and only holding the values bound or computed in it.
+    the topology is copied before being changed if it is shared
+    """
+    __slots__ = ('_inputs', '_plan', '_state', '_shared', '_table')
+    Vertex = LazyVertex
+    Edge = LazyEdge
+
+    def __init__(self, **kwargs):
+        super().__init__()
+        self._inputs = {}
+        self._plan = None
+        self._state = None
+        self._shared = False
+        self._table = None
+        self._set_values(kwargs)
+    
+    def _unshare(self):
+        """copy the topology if it is shared with other instances"""
+        if not self._shared:
+            return
+        vertices = self._vertices
+        edges = self._edges
+        self._vertices = keydefaultdict(lambda name: self.Vertex(self, name))
+        for k, v in vertices.items():
+            self._vertices[k] = dataclasses.replace(v, graph=self, in_edges=[], out_edges=[])
+        self._edges = [dataclasses.replace(e, graph=self) for e in edges]
+        self._shared = False
+    
+    def add_edge(self, targets, func, *args, **kwargs):
+        # add edge to DAG
+        self._unshare()
+        sources = list(args) + list(kwargs.values())
+        super().add_edge(sources, targets)
+        self._edges[-1].func_wrapper = FuncWrapper(targets, func, *args, **kwargs)
+        self._plan = None
+        self._state = None
+    
+    def edge(self, func):
+        args = func_args(func)
+        targets = [func.__name__]
+        self.add_edge(targets, func, *args)
+
+    def _get_plan(self):
+        if self._plan is None:
+            plan = Plan()
+            for name in self._vertices:
+                plan.add_var(name)
+            for edge in self._edges:
+                wrapper = edge.func_wrapper
+                plan.add_node(wrapper.return_values, wrapper.func, *wrapper.args, **wrapper.kwargs)
+            self._plan = plan.compile()
+        return self._plan
+
+    def _get_state(self):
+        if self._state is None:
+            plan = self._get_plan()
+            state = State(plan, sparse=True)
+            for k, v in self._inputs.items():
+                if k in plan.index:
+                    state.values[plan.index[k]] = v
+            if self._table is not None:
+                state.shared = self._table
+                state.ids = {}
+            self._state = state
+        return self._state
+
+    def __call__(self, **kwargs):
+        other = object.__new__(type(self))
+        other._vertices = self._vertices
+        other._edges = self._edges
+        other._inputs = dict(self._inputs)
+        other._plan = self._get_plan()
+        other._state = None
+        other._shared = self._shared = True
+        other._table = self._table
+        other._set_values(kwargs)
+        return other
+
+    def map(self, **kwargs):
+        """
+        create an instance evaluating the DAG on columns of inputs (lists or
+        NumPy arrays of the same length), whose vertices depending on the
+        columns are columns too
+
+        a func marked with `vectorized` is called once on the columns, the
+        other ones are called once per row
+        """
+        from .batch import batch_plan
+        lengths = {len(v) for v in kwargs.values()}
+        if len(lengths) > 1:
+            raise ValueError(f'columns of different lengths: {sorted(lengths)}')
+        plan = self._get_plan()
+        other = self(**kwargs)
+        other._plan = batch_plan(plan, [plan.index[k] for k in kwargs if k in plan.index])
+        return other
+
+    def share(self, cache=None):
+        """
+        share the values computed by the instances of this DAG (created from
+        it after this call), so that a func is run once for the same args
+        values, whichever instance reads it first
+
+            dag.share(MemoryCache(max_bytes=1 << 30))
+            dag(a=1, b=2).d  # runs `c(a)` and `d(c, b)`
+            dag(a=1, b=3).d  # only runs `d(c, b)`
+
+        the values are kept in a `lazydag.cache.SharedValues`, in `cache`. they
+        are not shared when computed with an executor or asynchronously
+        """
+        from .cache import SharedValues
+        self._table = SharedValues(cache)
+        if self._state is not None:
+            self._state.shared = self._table
+            self._state.ids = {}
+        return self
+
+    def compute(self, *names, executor=None, free=False, pin=(), compiled=False):
+        """
+        compute several vertices at once, see `State.compute`. with `compiled`,
+        the evaluator generated for the DAG is shared by its instances
+        """
+        state = self._get_state()
+        index = state.plan.index
+        return state.compute(*[index[name] for name in names], executor=executor,
+                             free=free, pin=[index[name] for name in pin], compiled=compiled)
+
+    async def aget(self, name):
+        """await a vertex, whose funcs may be coroutine functions"""
+        state = self._get_state()
+        return await state.aget(state.plan.index[name])
+
+    def _is_reachable(self, name):
+        state = self._get_state()
+        if name not in state.plan.index:
+            return name in self._inputs
+        return state.is_reachable(state.plan.index[name])
+    
+    def _set_value(self, name, value):
+        self._set_values({name: value})
+
+    def _set_values(self, values):
+        """bind several vertices at once, invalidating their successors in one pass"""
+        for name in values:
+            vertex = self._vertices.get(name)
+            if vertex is not None and vertex.in_edges:
+                raise RuntimeError(f'can not set value to a var {name} whose func already set')
+        self._inputs.update(values)
+        if self._state is not None:
+            index = self._state.plan.index
+            self._state.update([(index[k], v) for k, v in values.items() if k in index])
+    
+    def _get_value(self, name):
+        state = self._get_state()
+        var = state.plan.index.get(name)
+        if var is None:
+            return self._inputs.get(name)
+        if state.is_reachable(var):
+            return state.get(var)
+    
+    #def __getitem__(self, name):
+    #    if isinstance(name, int):
+    #        return self._edges[name]
+    #    else:
+    #        return self._get_value(name)
+    
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self._get_value(name)
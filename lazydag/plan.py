@@ -0,0 +1,867 @@
+import threading
+import weakref
+from contextlib import contextmanager
+from types import FunctionType
+
+# `asyncio`, `concurrent.futures` and `inspect` are imported when needed, as
+# they take longer to import than the rest of lazydag
+
+
+class Empty:
+    pass
+
+_profiler = None # the `lazydag.profile.Profiler` enabled, if any
+
+
+_func_args = weakref.WeakKeyDictionary() # func -> the names of its args
+
+def func_args(func):
+    """
+    the names of the args of `func`, looking through decorators using
+    `functools.wraps`. they are found once per func, e.g. for the funcs
+    inherited by several lazyclasses
+    """
+    try:
+        return _func_args[func]
+    except (KeyError, TypeError):
+        pass
+    if type(func) is FunctionType and not hasattr(func, '__wrapped__'):
+        code = func.__code__
+        args = list(code.co_varnames[:code.co_argcount])
+    else:
+        import inspect
+        args = inspect.getfullargspec(inspect.unwrap(func)).args
+    try:
+        _func_args[func] = args
+    except TypeError:
+        pass # not weakly referenceable
+    return args
+
+_CO_COROUTINE = 0x80 # `inspect.CO_COROUTINE`
+
+def _is_async(func):
+    if type(func) is FunctionType and not hasattr(func, '_is_coroutine_marker'):
+        return bool(func.__code__.co_flags & _CO_COROUTINE)
+    import inspect
+    return inspect.iscoroutinefunction(func)
+
+_no_dirty = frozenset() # shared by the states until a var is set
+
+
+class _Unverified:
+    """
+    the `dirty` vars of a deferred `State`: the computed vars not verified
+    since the last revision, whose args may have changed
+    """
+    __slots__ = ['verified', 'producers', 'revision']
+    def __init__(self, verified, producers):
+        self.verified = verified
+        self.producers = producers
+        self.revision = 0
+
+    def __contains__(self, var):
+        return self.verified[var] < self.revision and self.producers[var] is not None
+
+    def __bool__(self):
+        return False # nothing to discard when verified
+
+def _equal(a, b):
+    return a is b or a == b
+
+def _identical(a, b):
+    return a is b
+
+
+class Sparse(dict):
+    """a sparse replacement for the lists of a `State`, only holding the vars set in it"""
+    __slots__ = ['default']
+    def __init__(self, default):
+        self.default = default
+
+    def __missing__(self, var):
+        return self.default
+
+
+class Node:
+    """a function of the graph, with its args and return values given as var indices"""
+    __slots__ = ['func', 'returns', 'args', 'kwargs', 'is_async']
+    def __init__(self, func, returns, args, kwargs):
+        self.func = func
+        self.returns = returns
+        self.args = args
+        self.kwargs = kwargs
+        self.is_async = _is_async(func)
+
+    def _check_sync(self, plan):
+        if self.is_async:
+            names = ', '.join(plan.names[var] for var in self.returns)
+            raise RuntimeError(f'func of {names} is a coroutine function, use `aget` instead')
+
+
+class Plan:
+    """
+    the static part of a lazy graph, compiled once and shared by all instances
+
+    vars and nodes are referred to by their indices, so that an instance
+    only needs to hold a list of values (see `State`)
+    """
+    def __init__(self):
+        self.names = []
+        self.index = {}
+        self.defaults = []
+        self.set_defaults = {} # var -> its default, for the vars with one
+        self.eqs = []        # var -> the equality used for early cutoff (or None)
+        self.producers = []  # var -> the node returning it (or None)
+        self.consumers = []  # var -> the nodes using it as an arg
+        self.nodes = []
+        self.positions = []  # node -> its position in a topological order
+        self.order = []      # nodes in topological order
+        self.derived = {}    # cache of the plans derived from this one
+
+    def add_var(self, name, default=Empty, eq=None):
+        if name in self.index:
+            return self.index[name]
+        var = len(self.names)
+        self.names.append(name)
+        self.index[name] = var
+        self.defaults.append(default)
+        if default is not Empty:
+            self.set_defaults[var] = default
+        self.eqs.append(_equal if eq is True else eq)
+        self.producers.append(None)
+        self.consumers.append([])
+        return var
+
+    def add_node(self, returns, func, *args, **kwargs):
+        # make sure the return values are not in the args
+        for name in returns:
+            if name in args or name in kwargs.values():
+                import inspect
+                func_str = f'{func.__name__}{str(inspect.signature(func))}'
+                raise RuntimeError(f'return value `{name}` in function {func_str} args')
+
+        returns = tuple(self.add_var(name) for name in returns)
+        args = tuple(self.add_var(name) for name in args)
+        kwargs = tuple((k, self.add_var(name)) for k, name in kwargs.items())
+        for var in returns:
+            if self.producers[var] is not None:
+                raise RuntimeError(f'func already set for var `{self.names[var]}`')
+        if len(returns) > 1:
+            # each return has its own version, unchanged if the same object is returned again
+            for var in returns:
+                if self.eqs[var] is None:
+                    self.eqs[var] = _identical
+
+        node = len(self.nodes)
+        self.nodes.append(Node(func, returns, args, kwargs))
+        self.positions.append(node)
+        for var in returns:
+            self.producers[var] = node
+        for var in args + tuple(var for _, var in kwargs):
+            self.consumers[var].append(node)
+
+        # the new node comes after its args, but maybe not before its consumers
+        for var in returns:
+            for consumer in self.consumers[var]:
+                self._add_link(node, consumer)
+        return node
+
+    def _next_nodes(self, node):
+        for var in self.nodes[node].returns:
+            yield from self.consumers[var]
+
+    def _prev_nodes(self, node):
+        for var in self._node_args(node):
+            if self.producers[var] is not None:
+                yield self.producers[var]
+
+    def _add_link(self, source, target):
+        """
+        keep the topological order when `target` depends on `source`
+        (Pearce & Kelly, "A dynamic topological sort algorithm for directed acyclic graphs")
+        """
+        positions = self.positions
+        lower, upper = positions[target], positions[source]
+        if upper < lower:
+            return
+
+        # the nodes after `target` to be moved, which should not include `source`
+        forward = {target: None}
+        stack = [target]
+        while stack:
+            node = stack.pop()
+            for next_node in self._next_nodes(node):
+                if next_node == source:
+                    cycle = [source, node]
+                    while forward[cycle[-1]] is not None:
+                        cycle.append(forward[cycle[-1]])
+                    names = [self.names[var] for node in reversed(cycle)
+                             for var in self.nodes[node].returns]
+                    raise RuntimeError('cycle detected for variables: ' + ', '.join(names))
+                if next_node not in forward and positions[next_node] < upper:
+                    forward[next_node] = node
+                    stack.append(next_node)
+
+        # the nodes before `source` to be moved
+        backward = {source}
+        stack = [source]
+        while stack:
+            node = stack.pop()
+            for prev_node in self._prev_nodes(node):
+                if prev_node not in backward and positions[prev_node] > lower:
+                    backward.add(prev_node)
+                    stack.append(prev_node)
+
+        # reuse their positions, the nodes before `source` first
+        nodes = sorted(backward, key=positions.__getitem__) + sorted(forward, key=positions.__getitem__)
+        for node, position in zip(nodes, sorted(positions[node] for node in nodes)):
+            positions[node] = position
+
+    def _node_args(self, node):
+        node = self.nodes[node]
+        return node.args + tuple(var for _, var in node.kwargs)
+
+    def descendants(self, vars):
+        """the given vars and all the vars depending on them"""
+        ret = set(vars)
+        stack = list(vars)
+        while stack:
+            for node in self.consumers[stack.pop()]:
+                for var in self.nodes[node].returns:
+                    if var not in ret:
+                        ret.add(var)
+                        stack.append(var)
+        return ret
+
+    def evaluator(self):
+        """a generated function computing vars in a `State`, see `lazydag.codegen`"""
+        key = ('codegen',)
+        evaluate = self.derived.get(key)
+        if evaluate is None:
+            from .codegen import generate
+            evaluate = self.derived[key] = generate(self)
+        return evaluate
+
+    def compile(self):
+        self.order = sorted(range(len(self.nodes)), key=self.positions.__getitem__)
+        return self
+
+
+class State:
+    """
+    the values of one instance of a `Plan`
+
+    setting a var marks its successors as dirty, but keeps their values. when
+    a dirty var is read, its node is only run again if one of its args has
+    changed since it was last verified. with an `eq` set on a var, a new value
+    equal to the old one does not count as a change, so that the nodes below
+    it are not run again (early cutoff)
+
+    with `threadsafe`, the state can be read and set from several threads:
+    the readers of a node being run wait for it instead of running it again.
+    with `compiled`, the nodes are run by functions generated for them (see
+    `Plan.evaluator`) instead of by walking their args and returns
+
+    with `deferred`, setting a var does not mark its successors as dirty, so
+    that it takes the same time whatever their number. instead, each
+    revision of the state makes all the computed vars dirty, and a var read
+    is verified by verifying its args first (once per revision). this is
+    faster when vars are set much more often than read. so the profiler does
+    not count the invalidations of a deferred state
+    """
+    __slots__ = ['plan', 'values', 'changed', 'verified', 'dirty', 'revision', 'tasks', 'freed',
+                 'published', 'pending', 'lock', 'flights', 'compiled', 'deferred', 'shared', 'ids']
+    def __init__(self, plan, sparse=False, threadsafe=False, compiled=False, deferred=False):
+        self.plan = plan
+        if sparse:
+            self.values = Sparse(Empty)
+            self.values.update(plan.set_defaults)
+            self.changed = Sparse(0)
+            self.verified = Sparse(0)
+        else:
+            self.values = list(plan.defaults)
+            self.changed = [0] * len(plan.names)  # var -> revision of its last change
+            self.verified = [0] * len(plan.names) # var -> revision of its last verification
+        self.dirty = _Unverified(self.verified, plan.producers) if deferred else _no_dirty
+        self.revision = 0
+        self.tasks = None # node -> the task computing it, see `aget`
+        self.freed = None # the vars whose values were freed by `compute`
+        self.published = None # name -> value of the clean vars, e.g. the `__dict__` of a lazyclass instance
+        self.pending = None   # var -> value set in a `batch`
+        self.lock = threading.RLock() if threadsafe else None
+        self.flights = {} if threadsafe else None # node -> the future of its run
+        self.compiled = compiled
+        self.deferred = deferred
+        self.shared = None # the `lazydag.cache.SharedValues` of the values computed, if any
+        self.ids = None    # var -> (the id of its value in `shared`, the value)
+
+    def _is_clean(self, var):
+        return self.values[var] is not Empty and var not in self.dirty
+
+    def get(self, var):
+        value = self.values[var]
+        if value is Empty or var in self.dirty:
+            node = self.plan.producers[var]
+            if node is None:
+                raise AttributeError(f'value and func not set for var `{self.plan.names[var]}`')
+            if self.lock is not None:
+                self._call_once(node)
+            elif self.compiled and _profiler is None and self.shared is None:
+                self.plan.evaluator()(self, (var,))
+            else:
+                self._call(self.plan.nodes[node])
+            value = self.values[var]
+            if value is Empty:
+                raise RuntimeError('value still not set after func call')
+        return value
+
+    def _call_once(self, node):
+        """run a node, or wait for the thread running it"""
+        from concurrent.futures import Future
+        with self.lock:
+            flight = self.flights.get(node)
+            if flight is None:
+                flight = self.flights[node] = Future()
+                flight.set_running_or_notify_cancel()
+            else:
+                flight, waiting = None, flight
+        if flight is None:
+            waiting.result()
+            return
+        try:
+            self._call(self.plan.nodes[node])
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(None)
+        finally:
+            with self.lock:
+                del self.flights[node]
+
+    def set(self, var, value):
+        self.update(((var, value),))
+
+    def update(self, items):
+        """
+        set several vars from `(var, value)` pairs, invalidating their
+        successors in one pass. no var is set if one of them can not be
+        """
+        plan = self.plan
+        items = list(items)
+        for var, _ in items:
+            if plan.producers[var] is not None:
+                raise RuntimeError(
+                    f'can not set value to a var {plan.names[var]} whose func already set')
+        if self.pending is not None:
+            self.pending.update(items)
+        elif self.lock is None:
+            self._apply(items)
+        else:
+            with self.lock:
+                self._apply(items)
+
+    def _apply(self, items):
+        plan = self.plan
+        values, eqs = self.values, plan.eqs
+        items = [(var, value) for var, value in items
+                 if eqs[var] is None or values[var] is Empty or not eqs[var](values[var], value)]
+        if not items:
+            return
+        self.revision += 1
+        published = self.published
+        for var, value in items:
+            values[var] = value
+            self.changed[var] = self.revision
+            if published is not None:
+                published.pop(plan.names[var], None)
+        if self.deferred:
+            self.dirty.revision = self.revision
+        else:
+            self._invalidate([var for var, _ in items])
+
+    def _invalidate(self, vars):
+        """
+        make all successors of `vars` dirty, stopping at the ones already
+        dirty or not computed (unless freed), as their successors are dirty
+        or not computed too
+        """
+        plan, values, published = self.plan, self.values, self.published
+        dirty, consumers, nodes = self.dirty, plan.consumers, plan.nodes
+        freed = self.freed or ()
+        stack = list(vars)
+        while stack:
+            for node in consumers[stack.pop()]:
+                for successor in nodes[node].returns:
+                    if values[successor] is not Empty:
+                        if successor not in dirty:
+                            if _profiler is not None and successor == nodes[node].returns[0]:
+                                _profiler.invalidated(plan, nodes[node])
+                            if dirty is _no_dirty:
+                                dirty = self.dirty = set()
+                            dirty.add(successor)
+                            stack.append(successor)
+                            if published is not None:
+                                published.pop(plan.names[successor], None)
+                    elif successor in freed:
+                        freed.discard(successor)
+                        stack.append(successor)
+
+    @contextmanager
+    def batch(self):
+        """
+        defer the vars set in this block to its end, where they are set at
+        once by `update`. they are not set if the block raises
+        """
+        if self.pending is not None:
+            yield
+            return
+        self.pending = {}
+        try:
+            yield
+            pending = self.pending
+        finally:
+            self.pending = None
+        self.update(pending.items())
+
+    def is_reachable(self, var, _memo=None):
+        if self.values[var] is not Empty:
+            return True
+        node = self.plan.producers[var]
+        if node is None:
+            return False
+        memo = {} if _memo is None else _memo
+        if var not in memo:
+            memo[var] = all(self.is_reachable(arg, memo) for arg in self.plan._node_args(node))
+        return memo[var]
+
+    def compute(self, *vars, executor=None, free=False, pin=(), compiled=None):
+        """
+        compute several vars at once
+
+        the nodes they need are collected and run in topological order,
+        without recursion, so that graphs of any depth can be computed.
+        with an `executor` (e.g. a `ThreadPoolExecutor`), the nodes which do
+        not depend on each other are run concurrently, each node only once.
+        with `free`, the values computed here are dropped once all their
+        consumers have run, except for `vars` and the `pin`ned vars, so that
+        the peak memory is the widest cut of the graph instead of its size.
+        with `compiled` (by default, the one of the state), they are computed
+        by the evaluator generated for the plan, unless an option above is given
+        """
+        schedule = getattr(executor, 'schedule', None)
+        if compiled is None:
+            compiled = self.compiled
+        if (compiled and executor is None and not free and self.lock is None
+                and _profiler is None and self.shared is None):
+            self.plan.evaluator()(self, vars)
+        elif schedule is not None:
+            # e.g. a `lazydag.process.ProcessPool`, running the nodes itself
+            schedule(self, vars, free, pin)
+        else:
+            self._schedule(vars, executor, free, pin)
+        return tuple(self.get(var) for var in vars)
+
+    def _collect(self, vars):
+        """the nodes to be run to compute `vars` (node -> its args), and the vars they compute"""
+        plan, values, dirty = self.plan, self.values, self.dirty
+        pending = {}
+        stale = set()
+        stack = list(vars)
+        while stack:
+            var = stack.pop()
+            if var in stale or (values[var] is not Empty and var not in dirty):
+                continue
+            stale.add(var)
+            node = plan.producers[var]
+            if node is None:
+                raise AttributeError(f'value and func not set for var `{plan.names[var]}`')
+            if node in pending:
+                continue
+            pending[node] = args = plan._node_args(node)
+            stack.extend(args)
+        return pending, stale
+
+    def _schedule(self, vars, executor=None, free=False, pin=()):
+        plan, values = self.plan, self.values
+        pending, stale = self._collect(vars)
+
+        # count the consumers of the values computed here
+        refcounts = {}
+        if free:
+            keep = set(vars) | set(pin)
+            for node in pending:
+                for var in plan.nodes[node].returns:
+                    refcounts[var] = 0
+            for node in pending:
+                for var in plan._node_args(node):
+                    if var in refcounts:
+                        refcounts[var] += 1
+            if self.freed is None:
+                self.freed = set()
+        def release(node):
+            for var in node.returns:
+                if refcounts.get(var) == 0 and var not in keep:
+                    values[var] = Empty
+                    self.freed.add(var)
+            for var in node.args + tuple(var for _, var in node.kwargs):
+                if var in refcounts:
+                    refcounts[var] -= 1
+                    if refcounts[var] == 0 and var not in keep:
+                        values[var] = Empty
+                        self.freed.add(var)
+
+        if executor is None:
+            # run the nodes in topological order
+            spans = {} # node -> its inclusive span, until a consumer counts it in its own
+            for n in sorted(pending, key=plan.positions.__getitem__):
+                node = plan.nodes[n]
+                if self.lock is not None:
+                    # run once for all the threads, as when read
+                    self._call_once(n)
+                elif _profiler is not None:
+                    # as when its args are pulled, the time of the stale args it uses first
+                    producers = {plan.producers[var] for var in pending[n]}
+                    args = [spans.pop(producer) for producer in producers if producer in spans]
+                    with _profiler.span(plan, node, inclusive=True, args=args) as span:
+                        self._update(node)
+                    spans[n] = span
+                else:
+                    self._update(node)
+                if free:
+                    release(node)
+            return
+
+        # run the nodes in dependency order, once their args are computed
+        from concurrent.futures import FIRST_COMPLETED, wait
+        for node, args in pending.items():
+            pending[node] = sum(1 for arg in args if arg in stale)
+        running = {}
+        def ready(n):
+            node = plan.nodes[n]
+            if self.lock is not None:
+                # run once for all the threads, with the revision of its args (see `_update_locked`)
+                running[executor.submit(self._call_once, n)] = node
+                return
+            if self._is_fresh(node):
+                self._set_verified(node)
+                done(node)
+                return
+            node._check_sync(plan)
+            args = [values[var] for var in node.args]
+            kwargs = {k: values[var] for k, var in node.kwargs}
+            if _profiler is not None:
+                future = executor.submit(_profiler.run, plan, node, *args, **kwargs)
+            else:
+                future = executor.submit(node.func, *args, **kwargs)
+            running[future] = node
+        def done(node):
+            if free:
+                release(node)
+            for var in node.returns:
+                # only the stale args were counted, the other returns were up to date
+                if var not in stale:
+                    continue
+                for consumer in plan.consumers[var]:
+                    if consumer in pending:
+                        pending[consumer] -= 1
+                        if pending[consumer] == 0:
+                            ready(consumer)
+        for node, n in list(pending.items()):
+            if n == 0:
+                ready(node)
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                if self.lock is not None:
+                    future.result()
+                else:
+                    self._set_returned(node, future.result())
+                done(node)
+
+    def _changes(self, vars, values, seen):
+        """
+        the vars whose values changed since `seen` (var -> the revision of its
+        last change and its value yielded), compared with their `eq`, or `==`
+        """
+        changed, eqs = self.changed, self.plan.eqs
+        ret = {}
+        for var, value in zip(vars, values):
+            last = seen.get(var)
+            if last is not None:
+                revision, old = last
+                if revision == changed[var]:
+                    continue
+                eq = eqs[var]
+                if eq is None or eq is _identical:
+                    eq = _equal
+                try:
+                    same = bool(eq(old, value))
+                except Exception: # e.g. the `==` of arrays
+                    same = False
+                if same:
+                    seen[var] = (changed[var], old)
+                    continue
+            seen[var] = (changed[var], value)
+            ret[var] = value
+        return ret
+
+    def stream(self, updates, vars, coalesce=1):
+        """
+        set the vars of each update (a list of `(var, value)` pairs) of an
+        iterable, and yield the `vars` whose values changed, as dicts var -> value.
+        a value is compared to the one last yielded with the `eq` of its var,
+        or with `==`, so that a value computed again but equal is not yielded
+
+        the current values are yielded first. `coalesce` updates are set at
+        once (see `update`) before the changes are read
+        """
+        seen = {}
+        yield self._changes(vars, self.compute(*vars), seen)
+        batch = {}
+        n = 0
+        for update in updates:
+            batch.update(update)
+            n += 1
+            if n < coalesce:
+                continue
+            self.update(batch.items())
+            batch, n = {}, 0
+            changes = self._changes(vars, self.compute(*vars), seen)
+            if changes:
+                yield changes
+        if batch:
+            self.update(batch.items())
+            changes = self._changes(vars, self.compute(*vars), seen)
+            if changes:
+                yield changes
+
+    async def astream(self, updates, vars, coalesce=1, latency=None):
+        """
+        the async version of `stream`, for an async iterable of updates
+
+        the updates received while the changes are computed are coalesced, up
+        to `coalesce` updates. with a `latency` (in seconds), an update also
+        waits that long for the next ones
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        async def receive():
+            try:
+                async for update in updates:
+                    await queue.put((update, None))
+                await queue.put((Empty, None))
+            except Exception as e:
+                await queue.put((Empty, e))
+        receiver = asyncio.ensure_future(receive())
+
+        async def changes():
+            values = await asyncio.gather(*[self.aget(var) for var in vars])
+            return self._changes(vars, values, seen)
+
+        seen = {}
+        try:
+            yield await changes()
+            end = False
+            while not end:
+                update, error = await queue.get()
+                if error is not None:
+                    raise error
+                if update is Empty:
+                    break
+                batch = dict(update)
+                deadline = None if latency is None else loop.time() + latency
+                for _ in range(coalesce - 1):
+                    if not queue.empty():
+                        update, error = queue.get_nowait()
+                    elif deadline is None:
+                        break
+                    else:
+                        try:
+                            update, error = await asyncio.wait_for(
+                                queue.get(), max(0, deadline - loop.time()))
+                        except asyncio.TimeoutError:
+                            break
+                    if error is not None:
+                        raise error
+                    if update is Empty:
+                        end = True
+                        break
+                    batch.update(update)
+                self.update(batch.items())
+                ret = await changes()
+                if ret:
+                    yield ret
+        finally:
+            receiver.cancel()
+
+    async def aget(self, var):
+        """
+        the awaitable version of `get`, which also accepts coroutine functions
+
+        the args of a node are computed concurrently, and concurrent awaiters
+        of the same node share one task
+        """
+        import asyncio
+        value = self.values[var]
+        if value is Empty or var in self.dirty:
+            node = self.plan.producers[var]
+            if node is None:
+                raise AttributeError(f'value and func not set for var `{self.plan.names[var]}`')
+            if self.tasks is None:
+                self.tasks = {}
+            task = self.tasks.get(node)
+            if task is None:
+                task = asyncio.ensure_future(self._acall(self.plan.nodes[node]))
+                self.tasks[node] = task
+                task.add_done_callback(lambda _: self.tasks.pop(node, None))
+            await asyncio.shield(task)
+            value = self.values[var]
+            if value is Empty:
+                raise RuntimeError('value still not set after func call')
+        return value
+
+    async def _acall(self, node):
+        values = self.values
+        args = node.args + tuple(var for _, var in node.kwargs)
+        missing = [var for var in set(args) if not self._is_clean(var)]
+        if missing:
+            import asyncio
+            await asyncio.gather(*[self.aget(var) for var in missing])
+        if self._is_fresh(node):
+            self._set_verified(node)
+            return
+        revision = self.revision
+        args = [values[var] for var in node.args]
+        kwargs = {k: values[var] for k, var in node.kwargs}
+        if _profiler is not None:
+            with _profiler.span(self.plan, node) as span:
+                ret = node.func(*args, **kwargs)
+                if node.is_async:
+                    ret = await ret
+                span.value = ret
+        else:
+            ret = node.func(*args, **kwargs)
+            if node.is_async:
+                ret = await ret
+        self._set_returned_since(node, ret, revision)
+
+    def _call(self, node):
+        if _profiler is not None:
+            with _profiler.span(self.plan, node, inclusive=True):
+                return self._pull(node)
+        self._pull(node)
+
+    def _pull(self, node):
+        for var in node.args:
+            self.get(var)
+        for _, var in node.kwargs:
+            self.get(var)
+        self._update(node)
+
+    def _update(self, node):
+        """run a node whose args are up to date, unless they did not change"""
+        if self.lock is not None:
+            return self._update_locked(node)
+        if self._is_fresh(node):
+            self._set_verified(node)
+            return
+        node._check_sync(self.plan)
+        shared = self.shared
+        if shared is not None:
+            key, ret = shared.lookup(self, node)
+            if ret is not Empty:
+                if _profiler is not None:
+                    _profiler.cache_hit()
+                self._set_returned(node, ret)
+                return
+        values = self.values
+        args = [values[var] for var in node.args]
+        kwargs = {k: values[var] for k, var in node.kwargs}
+        if _profiler is not None:
+            ret = _profiler.run(self.plan, node, *args, **kwargs)
+        else:
+            ret = node.func(*args, **kwargs)
+        if shared is not None:
+            shared.store(self, node, key, ret)
+        self._set_returned(node, ret)
+
+    def _update_locked(self, node):
+        values = self.values
+        while True:
+            with self.lock:
+                stale = [var for var in node.args + tuple(var for _, var in node.kwargs)
+                         if not self._is_clean(var)]
+                if not stale:
+                    if self._is_fresh(node):
+                        self._set_verified(node)
+                        return
+                    revision = self.revision
+                    args = [values[var] for var in node.args]
+                    kwargs = {k: values[var] for k, var in node.kwargs}
+                    break
+            # set by another thread since they were read
+            for var in stale:
+                self.get(var)
+        node._check_sync(self.plan)
+        if _profiler is not None:
+            ret = _profiler.run(self.plan, node, *args, **kwargs)
+        else:
+            ret = node.func(*args, **kwargs)
+        with self.lock:
+            self._set_returned_since(node, ret, revision)
+
+    def _set_returned_since(self, node, ret, revision):
+        """set the returns of a node run with the args of `revision`"""
+        # verified as of the revision of its args
+        self._set_returned(node, ret, revision)
+        if self.revision != revision and not self.deferred:
+            # they were set while it ran, so it is checked again when read
+            if self.dirty is _no_dirty:
+                self.dirty = set()
+            self.dirty.update(node.returns)
+            if self.published is not None:
+                for var in node.returns:
+                    self.published.pop(self.plan.names[var], None)
+            self._invalidate(node.returns)
+
+    def _is_fresh(self, node):
+        """whether the (up to date) args of a node did not change since its returns were verified"""
+        values, changed = self.values, self.changed
+        verified = self.verified[node.returns[0]]
+        for var in node.returns:
+            if values[var] is Empty:
+                return False
+        # a freed arg does not bump `changed`, but it is not up to date
+        for var in node.args:
+            if changed[var] > verified or values[var] is Empty:
+                return False
+        for _, var in node.kwargs:
+            if changed[var] > verified or values[var] is Empty:
+                return False
+        return True
+
+    def _set_verified(self, node, revision=None):
+        if _profiler is not None:
+            _profiler.verified(self.plan, node)
+        if revision is None:
+            revision = self.revision
+        dirty = self.dirty
+        for var in node.returns:
+            self.verified[var] = revision
+            if dirty:
+                dirty.discard(var)
+
+    def _set_returned(self, node, ret, revision=None):
+        if len(node.returns) == 1:
+            ret = [ret]
+        values, eqs = self.values, self.plan.eqs
+        for var, value in zip(node.returns, ret):
+            old = values[var]
+            if eqs[var] is not None and old is not Empty and eqs[var](old, value):
+                continue
+            values[var] = value
+            self.changed[var] = self.revision
+        self._set_verified(node, revision)
@@ -0,0 +1,257 @@
+import importlib
+import mmap
+import os
+import pickle
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .plan import Empty
+
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+#########################
+# region: transfer of values
+
+class _Bytes:
+    """large bytes, pickled out-of-band (and copied once when loaded)"""
+    __slots__ = ['value']
+    def __init__(self, value):
+        self.value = value
+
+    def __reduce_ex__(self, protocol):
+        return type(self.value), (pickle.PickleBuffer(self.value),)
+
+def _dump(value, min_bytes):
+    """
+    pickle a value, writing its out-of-band buffers (e.g. of NumPy arrays)
+    of at least `min_bytes` to files in shared memory instead
+    """
+    files = []
+    def buffer_callback(buffer):
+        raw = buffer.raw()
+        if raw.nbytes < min_bytes:
+            return True # pickled in-band
+        fd, path = tempfile.mkstemp(prefix='lazydag-', dir=_SHM_DIR)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(raw)
+        files.append(path)
+    if type(value) in (bytes, bytearray) and len(value) >= min_bytes:
+        value = _Bytes(value)
+    return pickle.dumps(value, protocol=5, buffer_callback=buffer_callback), files
+
+def _load(payload, remove=False):
+    """unpickle a value, whose buffers are memory-mapped from their files (copy on write)"""
+    data, files = payload
+    buffers = []
+    for path in files:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            buffers.append(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY) if size else b'')
+        if remove:
+            _remove(path)
+    return pickle.loads(data, buffers=buffers)
+
+def _discard(future):
+    if not future.cancelled() and future.exception() is None:
+        for _, files in future.result().values():
+            for path in files:
+                _remove(path)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+# endregion
+
+#########################
+# region: funcs
+
+class _LazyFuncRef:
+    """a reference to the func of a lazy property, as the func itself can not be pickled"""
+    __slots__ = ['module', 'owner', 'name']
+    def __init__(self, module, owner, name):
+        self.module = module
+        self.owner = owner
+        self.name = name
+
+    def __getstate__(self):
+        return self.module, self.owner, self.name
+
+    def __setstate__(self, state):
+        self.module, self.owner, self.name = state
+
+    def resolve(self):
+        obj = importlib.import_module(self.module)
+        for name in self.owner.split('.'):
+            obj = getattr(obj, name)
+        return getattr(obj, self.name)._func
+
+def _reference(func):
+    """a picklable reference to a node func"""
+    try:
+        pickle.dumps(func)
+        return func
+    except (pickle.PicklingError, AttributeError, TypeError):
+        pass
+    owner, _, name = getattr(func, '__qualname__', '').rpartition('.')
+    if not owner or '<locals>' in owner:
+        raise RuntimeError(f'func {func.__qualname__} can not be sent to worker processes, '
+                           'define it at the top level of a module')
+    return _LazyFuncRef(func.__module__, owner, name.split('__')[0])
+
+def _references(plan):
+    key = ('process', 'funcs')
+    if key not in plan.derived:
+        plan.derived[key] = [_reference(node.func) for node in plan.nodes]
+    return plan.derived[key]
+
+def _run_chain(steps, inputs, outputs, min_bytes):
+    """run a chain of nodes in a worker, and return the values of `outputs`"""
+    values = {var: _load(payload) for var, payload in inputs.items()}
+    for func, args, kwargs, returns in steps:
+        if isinstance(func, _LazyFuncRef):
+            func = func.resolve()
+        ret = func(*[values[var] for var in args], **{k: values[var] for k, var in kwargs})
+        if len(returns) == 1:
+            ret = [ret]
+        values.update(zip(returns, ret))
+    return {var: _dump(values[var], min_bytes) for var in outputs}
+
+# endregion
+
+class ProcessPool:
+    """
+    an executor for `compute`, running the nodes in worker processes
+
+        with ProcessPool(4) as pool:
+            obj.compute('c', executor=pool)
+
+    the funcs are sent by reference, so they must be defined at the top level
+    of a module, or in a lazyclass defined there. the values are pickled,
+    except for their buffers of `min_shared_bytes` or more (of NumPy arrays,
+    or bytes), which are passed as memory-mapped files in shared memory
+
+    each chain of nodes, whose only consumer of a node is the next one, is
+    run in one task, so that the values inside a chain are not sent back and
+    forth. these values are not kept, unless they are computed or `pin`ned
+    """
+    def __init__(self, max_workers=None, min_shared_bytes=1 << 16, mp_context=None):
+        self.executor = ProcessPoolExecutor(max_workers, mp_context)
+        self.min_shared_bytes = min_shared_bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+    def schedule(self, state, vars, free=False, pin=()):
+        """run the nodes computing `vars` in a `State`, see `State.compute`"""
+        plan, values = state.plan, state.values
+        pending, stale = state._collect(vars)
+        for node in pending:
+            plan.nodes[node]._check_sync(plan)
+        funcs = _references(plan)
+        keep = set(vars) | set(pin)
+        if state.freed is None:
+            state.freed = set()
+
+        # link each node to its only consumer, if it is its only producer
+        consumers = {node: {c for var in plan.nodes[node].returns
+                            for c in plan.consumers[var] if c in pending}
+                     for node in pending}
+        producers = {node: {plan.producers[var] for var in args if var in stale}
+                     for node, args in pending.items()}
+        next_node = {node: next(iter(c)) for node, c in consumers.items()
+                     if len(c) == 1 and len(producers[next(iter(c))]) == 1}
+        heads = set(pending) - set(next_node.values())
+        chains = []
+        for node in sorted(heads, key=plan.positions.__getitem__):
+            chain = [node]
+            while chain[-1] in next_node:
+                chain.append(next_node[chain[-1]])
+            chains.append(chain)
+
+        # the vars computed elsewhere each chain waits for
+        needs = []
+        waiters = {}
+        for i, chain in enumerate(chains):
+            inside = {var for node in chain for var in plan.nodes[node].returns}
+            needs.append({var for node in chain for var in pending[node]
+                          if var in stale and var not in inside})
+            for var in needs[i]:
+                waiters.setdefault(var, []).append(i)
+        waiting = [set(need) for need in needs]
+        refcounts = {var: len(ids) for var, ids in waiters.items()}
+
+        shipped = {} # var -> its payload, written once
+        running = {}
+        def ready(i):
+            chain = chains[i]
+            # skip the nodes whose args did not change
+            verified = []
+            while chain and state._is_fresh(plan.nodes[chain[0]]):
+                state._set_verified(plan.nodes[chain[0]])
+                verified.append(chain.pop(0))
+            if not chain:
+                done(i, {var: values[var] for node in verified for var in plan.nodes[node].returns})
+                return
+            nodes = [plan.nodes[node] for node in chain]
+            inside = {var for node in nodes for var in node.returns}
+            inputs = {}
+            for node in chain:
+                for var in pending[node]:
+                    if var not in inside:
+                        if var not in shipped:
+                            shipped[var] = _dump(values[var], self.min_shared_bytes)
+                        inputs[var] = shipped[var]
+            outputs = [var for node in nodes for var in node.returns
+                       if var in keep or var in waiters or (not free and node is nodes[-1])]
+            steps = [(funcs[node], plan.nodes[node].args, plan.nodes[node].kwargs,
+                      plan.nodes[node].returns) for node in chain]
+            future = self.executor.submit(_run_chain, steps, inputs, outputs, self.min_shared_bytes)
+            running[future] = i
+        def done(i, result):
+            # `result` holds the values returned by the nodes run, or verified
+            for node in chains[i]:
+                node = plan.nodes[node]
+                for var in node.returns:
+                    if var not in result:
+                        values[var] = Empty
+                        state.freed.add(var)
+                ret = [result.get(var, Empty) for var in node.returns]
+                state._set_returned(node, ret[0] if len(ret) == 1 else ret)
+            if free:
+                for var in needs[i]:
+                    refcounts[var] -= 1
+                    if refcounts[var] == 0 and var not in keep:
+                        values[var] = Empty
+                        state.freed.add(var)
+            for var in result:
+                for j in waiters.get(var, ()):
+                    waiting[j].discard(var)
+                    if not waiting[j]:
+                        ready(j)
+
+        try:
+            for i in range(len(chains)):
+                if not waiting[i]:
+                    ready(i)
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    result = {var: _load(payload, remove=True) for var, payload in future.result().items()}
+                    done(i, result)
+        finally:
+            for _, files in shipped.values():
+                for path in files:
+                    _remove(path)
+            for future in running:
+                # after an error, remove the files returned by the other tasks
+                future.add_done_callback(_discard)
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from . import plan as _plan
+from .cache import sizeof
+from .plan import Empty
+
+class NodeStats:
+    """the stats of a node, with times in seconds"""
+    __slots__ = ['name', 'func', 'calls', 'wall', 'cpu', 'wall_inclusive', 'cpu_inclusive',
+                 'cache_hits', 'verified', 'invalidations', 'bytes']
+    def __init__(self, name, func):
+        self.name = name        # the names of its returns, joined by `__`
+        self.func = func        # the qualified name of its func
+        self.calls = 0          # times its func was run
+        self.wall = 0.          # time in its func
+        self.cpu = 0.
+        self.wall_inclusive = 0. # time in its func and computing its args
+        self.cpu_inclusive = 0.
+        self.cache_hits = 0     # runs served by `lazydag.cache.cached`
+        self.verified = 0       # times it was found up to date without being run
+        self.invalidations = 0  # times it was made dirty (not counted for a deferred `State`)
+        self.bytes = None       # size of the last value it returned
+
+class _Span:
+    __slots__ = ['profiler', 'key', 'inclusive', 'args', 'parent', 'start', 'cpu', 'value', 'total']
+    def __init__(self, profiler, key, inclusive, args=()):
+        self.profiler = profiler
+        self.key = key
+        self.inclusive = inclusive
+        self.args = args   # the inclusive spans of the args computed for it before it
+        self.value = Empty
+        self.total = None  # its inclusive (wall, cpu) time, once recorded
+
+    def __enter__(self):
+        stack = self.profiler._stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        stack = self.profiler._stack()
+        if stack[-1] is self:
+            stack.pop()
+        else:
+            # spans of concurrent tasks of the same thread
+            stack.remove(self)
+        self.profiler._record(self, wall, cpu)
+
+class Profiler:
+    """
+    per-node stats and trace events, recorded while enabled (see `profiling`)
+
+    the stats are keyed by the qualified name of the func of a node and the
+    names of its returns (see `key`), so that the nodes of the same names in
+    different classes or DAGs are told apart
+
+    when the profiler is off, the only cost is a check for `None` per node run
+    """
+    def __init__(self, trace=True):
+        self.stats = {} # key -> `NodeStats`
+        self.events = [] if trace else None
+        self._start = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def name(plan, node):
+        return '__'.join(plan.names[var] for var in node.returns)
+
+    @staticmethod
+    def key(plan, node):
+        """`(qualified name of its func, names of its returns)`"""
+        func = node.func
+        qualname = getattr(func, '__qualname__', type(func).__qualname__)
+        return (f'{getattr(func, "__module__", None)}.{qualname}', Profiler.name(plan, node))
+
+    def _stats(self, key):
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = NodeStats(key[1], key[0])
+        return stats
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def span(self, plan, node, inclusive=False, args=()):
+        """
+        a context timing a node: its func only, or with its args if `inclusive`.
+        the inclusive spans of its `args` computed before it (rather than
+        within the span) are added to its inclusive time
+        """
+        return _Span(self, self.key(plan, node), inclusive, args)
+
+    def run(self, plan, node, *args, **kwargs):
+        with self.span(plan, node) as span:
+            span.value = node.func(*args, **kwargs)
+        return span.value
+
+    def verified(self, plan, node):
+        with self._lock:
+            self._stats(self.key(plan, node)).verified += 1
+
+    def invalidated(self, plan, node):
+        with self._lock:
+            self._stats(self.key(plan, node)).invalidations += 1
+
+    def cache_hit(self):
+        stack = self._stack()
+        if stack:
+            with self._lock:
+                self._stats(stack[-1].key).cache_hits += 1
+
+    def _record(self, span, wall, cpu):
+        size = None if span.value is Empty else sizeof(span.value)
+        with self._lock:
+            stats = self._stats(span.key)
+            if span.inclusive:
+                span.total = (wall + sum(arg.total[0] for arg in span.args),
+                              cpu + sum(arg.total[1] for arg in span.args))
+                stats.wall_inclusive += span.total[0]
+                stats.cpu_inclusive += span.total[1]
+            else:
+                stats.calls += 1
+                stats.wall += wall
+                stats.cpu += cpu
+                stats.bytes = size
+                parent = span.parent
+                if parent is not None and parent.inclusive and parent.key == span.key:
+                    # the inclusive span of the node is recorded instead
+                    return
+                stats.wall_inclusive += wall
+                stats.cpu_inclusive += cpu
+            if self.events is not None:
+                self.events.append({
+                    'name': stats.name, 'cat': 'lazydag', 'ph': 'X',
+                    'ts': (span.start - self._start) * 1e6, 'dur': wall * 1e6,
+                    'pid': os.getpid(), 'tid': threading.get_ident(),
+                    'args': {'cpu_ms': cpu * 1e3, 'bytes': size},
+                })
+
+    def chrome_trace(self):
+        """the trace events, in the Chrome trace format (for chrome://tracing or Perfetto)"""
+        return {'traceEvents': list(self.events or ()), 'displayTimeUnit': 'ms'}
+
+    def dump_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """a text table of the stats of the nodes, sorted by self time"""
+        lines = [f'{"node":<24} {"calls":>7} {"self ms":>10} {"incl ms":>10} {"cpu ms":>10} '
+                 f'{"cached":>7} {"verified":>9} {"invalid":>8} {"bytes":>10}']
+        names = Counter(s.name for s in self.stats.values())
+        for s in sorted(self.stats.values(), key=lambda s: -s.wall):
+            # the nodes of the same name are told apart by their funcs
+            name = s.name if names[s.name] == 1 else f'{s.name} ({s.func})'
+            lines.append(f'{name:<24} {s.calls:>7} {s.wall * 1e3:>10.3f} {s.wall_inclusive * 1e3:>10.3f} '
+                         f'{s.cpu * 1e3:>10.3f} {s.cache_hits:>7} {s.verified:>9} {s.invalidations:>8} '
+                         f'{"" if s.bytes is None else s.bytes:>10}')
+        return '\n'.join(lines)
+
+def enable(profiler=None):
+    """start profiling all the lazy graphs"""
+    _plan._profiler = Profiler() if profiler is None else profiler
+    return _plan._profiler
+
+def disable():
+    """stop profiling, and return the profiler"""
+    profiler, _plan._profiler = _plan._profiler, None
+    return profiler
+
+@contextmanager
+def profiling(trace=True):
+    """
+        with profiling() as profiler:
+            obj.c
+        print(profiler.summary())
+        profiler.dump_chrome_trace('trace.json')
+    """
+    previous = _plan._profiler
+    profiler = enable(Profiler(trace))
+    try:
+        yield profiler
+    finally:
+        _plan._profiler = previous
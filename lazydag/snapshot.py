@@ -0,0 +1,154 @@
+"""
+snapshots of the values of a lazyclass instance or a LazyDAG instance
+
+    snapshot.save(obj, 'warm.lazydag')
+    obj = snapshot.load(A(), 'warm.lazydag')
+
+the out-of-band buffers of the values (e.g. of NumPy arrays) are stored
+aligned after a pickled header, and are memory-mapped (copy on write) when
+loaded instead of being copied. the computed values are dropped when loaded
+if the func computing them (or one of the funcs before it) changed
+"""
+import mmap
+import os
+import pickle
+import struct
+import threading
+
+from .cache import func_hash
+from .plan import Empty, State
+
+_MAGIC = b'LAZYDAG1'
+_ALIGN = 64
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+def _resolve(obj):
+    from . import LazyDAG
+    from .lazyclass import _get_state
+    if isinstance(obj, LazyDAG):
+        return obj._get_state()
+    return _get_state(obj)
+
+def _versions(plan):
+    """node -> the hash of its func"""
+    key = ('snapshot', 'versions')
+    if key not in plan.derived:
+        plan.derived[key] = [func_hash(node.func) for node in plan.nodes]
+    return plan.derived[key]
+
+def save(obj, path):
+    """
+    save the inputs and the up to date values of an instance to a file. the
+    values which can not be pickled are skipped, and computed again when read
+    """
+    state = _resolve(obj)
+    plan = state.plan
+    versions = _versions(plan)
+    entries = [] # (name, version, offset of its pickle, size, [(offset, size) of its buffers])
+    chunks = []  # (offset, data)
+    offset = 0
+    for var, name in enumerate(plan.names):
+        value = state.values[var]
+        if value is Empty or var in state.dirty:
+            continue
+        buffers = []
+        try:
+            data = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            continue
+        node = plan.producers[var]
+        chunks.append((offset, data))
+        entry = (name, None if node is None else versions[node], offset, len(data), [])
+        offset += len(data)
+        for buffer in buffers:
+            raw = buffer.raw()
+            offset = _align(offset)
+            chunks.append((offset, raw))
+            entry[4].append((offset, raw.nbytes))
+            offset += raw.nbytes
+        entries.append(entry)
+
+    header = pickle.dumps({'entries': entries}, protocol=5)
+    start = _align(len(_MAGIC) + 8 + len(header))
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_MAGIC + struct.pack('<Q', len(header)) + header)
+        for offset, data in chunks:
+            f.seek(start + offset)
+            f.write(data)
+    os.replace(tmp, path)
+
+def load(obj, path):
+    """
+    restore the values saved by `save` into an instance (e.g. a new one),
+    replacing its values, and return it
+    """
+    state = _resolve(obj)
+    plan = state.plan
+    versions = _versions(plan)
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f'{path} is not a lazydag snapshot')
+        size, = struct.unpack('<Q', f.read(8))
+        header = pickle.loads(f.read(size))
+        start = _align(len(_MAGIC) + 8 + size)
+        length = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_COPY) if length else b''
+
+    # the values of changed funcs, and of the vars after them, are stale
+    saved = {}
+    changed = []
+    for name, version, offset, size, buffers in header['entries']:
+        var = plan.index.get(name)
+        if var is None:
+            continue
+        node = plan.producers[var]
+        if (version is None) != (node is None) or (node is not None and version != versions[node]):
+            changed.append(var)
+            continue
+        saved[var] = (offset, size, buffers)
+    stale = plan.descendants(changed)
+
+    values = {}
+    view = memoryview(data)
+    for var, (offset, size, buffers) in saved.items():
+        if var in stale:
+            continue
+        values[var] = pickle.loads(view[start + offset:start + offset + size],
+                                   buffers=[view[start + o:start + o + n] for o, n in buffers])
+
+    from . import LazyDAG
+    new_state = State(plan, sparse=isinstance(obj, LazyDAG), threadsafe=state.lock is not None,
+                      compiled=state.compiled, deferred=state.deferred)
+    if state.shared is not None:
+        new_state.shared = state.shared
+        new_state.ids = {}
+    for var, value in values.items():
+        new_state.values[var] = value
+    # the computed vars before the restored ones which were not restored (e.g.
+    # not picklable) are freed, so that they are invalidated with their successors
+    freed = set()
+    stack = [var for var in values if plan.producers[var] is not None]
+    seen = set(stack)
+    while stack:
+        for var in plan._node_args(plan.producers[stack.pop()]):
+            if var not in seen and plan.producers[var] is not None:
+                seen.add(var)
+                stack.append(var)
+                if var not in values:
+                    freed.add(var)
+    new_state.freed = freed or None
+    if isinstance(obj, LazyDAG):
+        # the bindings of the instance are replaced too, as they are copied by its instances
+        obj._inputs = {plan.names[var]: value for var, value in values.items()
+                       if plan.producers[var] is None}
+        obj._state = new_state
+    else:
+        new_state.published = state.published
+        if state.published is not None:
+            for name in plan.names:
+                state.published.pop(name, None)
+        setattr(obj, '__lazy_state__', new_state)
+    return obj
@@ -1,5 +1,25 @@
+import os
 import unittest
 
+from lazydag.lazyclass import lazyclass
+
+# funcs run by `ProcessPool`, which need to be importable by the workers
+@lazyclass
+class _Pipeline:
+    def data(n):
+        return bytearray(range(256)) * n
+    def doubled(data):
+        return bytearray(2 * x % 256 for x in data)
+    def total(doubled):
+        return sum(doubled)
+    def size(data):
+        return len(data)
+    def summary(total, size):
+        return (total, size)
+
+def _increment(x):
+    return x + 1
+
 class TestLazy(unittest.TestCase):
     def test_lazy(self):
         from lazydag.lazy import LazyFunc, LazyValue
@@ -26,6 +46,372 @@ class TestLazyDAG(unittest.TestCase):
         self.assertEqual(dag(b=9).c, 12)
         self.assertEqual(dag(b=3).d, 9)
 
+    def test_instances(self):
+        from lazydag import LazyDAG
+        dag = LazyDAG(a=3)
+        dag.add_edge(['c'], lambda a, b: a + b, 'a', 'b')
+        dag.add_edge(['d'], lambda c: c * 2, 'c')
+        dag.add_edge(['e'], lambda a: -a, 'a')
+
+        x = dag(b=4)
+        self.assertIs(x._vertices, dag._vertices)
+        self.assertIs(x._plan, dag._plan)
+        self.assertEqual(x.c, 7)
+        # only the bound and computed vertices have a value
+        self.assertEqual(sorted(x._plan.names[var] for var in x._state.values), ['a', 'b', 'c'])
+        # a LazyDAG has no defaults to copy into its instances
+        self.assertEqual(x._plan.set_defaults, {})
+
+        # the template copies its topology before changing it
+        dag.add_edge(['f'], lambda d: d + 1, 'd')
+        self.assertIsNot(x._vertices, dag._vertices)
+        self.assertEqual(dag(b=1).f, 9)
+        self.assertEqual(x.d, 14)
+        self.assertIsNone(x.f)
+        self.assertEqual(len(x._vertices['d'].out_edges), 0)
+
+    def test_order(self):
+        from lazydag import LazyDAG
+        # edges added from the last vertex to the first one
+        dag = LazyDAG(v0=1)
+        for i in range(20, 0, -1):
+            dag.add_edge([f'v{i}'], lambda a: a + 1, f'v{i-1}')
+        dag.add_edge(['w'], lambda a, b: a * b, 'v20', 'v3')
+        plan = dag._get_plan()
+        self.assertEqual([plan.names[plan.nodes[n].returns[0]] for n in plan.order],
+                         [f'v{i}' for i in range(1, 21)] + ['w'])
+        self.assertEqual(dag(v0=2).w, 22 * 5)
+
+        dag.add_edge(['v0'], lambda a: a, 'v15')
+        with self.assertRaises(RuntimeError):
+            dag._get_plan()
+
+    def test_map(self):
+        from lazydag import LazyDAG, vectorized
+
+        calls = []
+        def c(a, b):
+            calls.append('c')
+            return a + b
+        @vectorized
+        def d(c):
+            calls.append('d')
+            return [x * 2 for x in c]
+        dag = LazyDAG(a=1)
+        dag.add_edge(['c'], c, 'a', 'b')
+        dag.add_edge(['d'], d, 'c')
+        dag.add_edge(['p', 'q'], lambda a, d: (d + a, d - a), 'a', d='d')
+        dag.add_edge(['r'], lambda a: a * 10, 'a')
+
+        batch = dag.map(b=[1, 2, 3])
+        self.assertEqual(batch.compute('c', 'd', 'q', 'r'), ([2, 3, 4], [4, 6, 8], [3, 5, 7], 10))
+        self.assertEqual(batch.p, [5, 7, 9])
+        self.assertEqual(calls, ['c', 'c', 'c', 'd'])
+        self.assertEqual(dag(b=1).c, 2)
+        with self.assertRaises(ValueError):
+            dag.map(a=[1], b=[1, 2])
+
+    def test_executor(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from lazydag import LazyDAG
+
+        # `x` and `y` only finish when they run at the same time
+        barrier = threading.Barrier(2, timeout=5)
+        calls = []
+        def branch(a):
+            calls.append(a)
+            barrier.wait()
+            return a
+        dag = LazyDAG(a=1)
+        dag.add_edge(['x'], branch, 'a')
+        dag.add_edge(['y'], branch, 'a')
+        dag.add_edge(['z'], lambda x, y: x + y, 'x', 'y')
+        with ThreadPoolExecutor(4) as executor:
+            self.assertEqual(dag(a=2).compute('z', 'x', executor=executor), (4, 2))
+        self.assertEqual(calls, [2, 2])
+
+    def test_share(self):
+        from lazydag import LazyDAG
+        from lazydag.cache import MemoryCache
+
+        calls = []
+        def c(a):
+            calls.append('c')
+            return [a * 2]
+        def d(c, b):
+            calls.append('d')
+            return c[0] + b
+        dag = LazyDAG()
+        dag.add_edge(['c'], c, 'a')
+        dag.add_edge(['d'], d, 'c', b='b')
+        dag.share(MemoryCache())
+
+        # the instances with the same inputs share the values computed by the others
+        self.assertEqual(dag(a=1, b=2).d, 4)
+        self.assertEqual(dag(a=1, b=3).d, 5)
+        self.assertEqual(dag(a=1, b=2).d, 4)
+        self.assertEqual(calls, ['c', 'd', 'd'])
+        self.assertIs(dag(a=1).c, dag(a=1).c)
+        # equal inputs of another type, or unhashable ones, only by identity
+        self.assertEqual(dag(a=1.0, b=2).d, 4.0)
+        inputs = [1]
+        self.assertEqual((dag(a=inputs).c, dag(a=inputs).c, dag(a=[1]).c), ([[1, 1]],) * 3)
+        self.assertEqual(calls, ['c', 'd', 'd', 'c', 'd', 'c', 'c'])
+
+        x = dag(a=1, b=2)
+        self.assertEqual(x.d, 4)
+        x._set_value('a', 5)
+        self.assertEqual(x.d, 12)
+        self.assertEqual(dag(a=5, b=2).compute('d', 'c'), (12, [10]))
+        self.assertEqual(calls[7:], ['c', 'd'])
+
+        # evicted values are computed again
+        dag.share(MemoryCache(max_bytes=0))
+        self.assertEqual((dag(a=1, b=2).d, dag(a=1, b=2).d), (4, 4))
+        self.assertEqual(calls[9:], ['c', 'd', 'c', 'd'])
+
+        # the restored instances still share the values
+        import tempfile
+        from lazydag import snapshot
+        dag.share(MemoryCache())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.lazydag')
+            snapshot.save(dag(a=1, b=2), path)
+            x = snapshot.load(dag(), path)
+        self.assertIs(x._state.shared, dag._table)
+        x._set_value('a', 7)
+        self.assertEqual((x.d, dag(a=7, b=2).d), (16, 16))
+        self.assertEqual(calls[13:], ['c', 'd'])
+
+        # the bindings of the instance are replaced by the restored ones
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x.lazydag')
+            snapshot.save(dag(a=1), path)
+            x = snapshot.load(dag(a=1, b=2), path)
+        self.assertEqual(x._inputs, {'a': 1})
+        self.assertIsNone(x(a=2).d)
+
+    def test_async(self):
+        import asyncio
+        from lazydag import LazyDAG
+
+        calls = []
+        dag = LazyDAG()
+        @dag.edge
+        async def b(a):
+            calls.append('b')
+            await asyncio.sleep(0.01)
+            return a + 1
+        dag.add_edge(['c'], lambda a, b: a * b, 'a', 'b')
+
+        async def main():
+            d = dag(a=3)
+            return await asyncio.gather(d.aget('c'), d.aget('b'), d.aget('c'))
+        self.assertEqual(asyncio.run(main()), [12, 4, 12])
+        self.assertEqual(calls, ['b'])
+
+        # a value set while a node is awaited makes it run again when read
+        async def set_while_awaited():
+            d = dag(a=3)
+            task = asyncio.ensure_future(d.aget('b'))
+            while calls.count('b') < 2:
+                await asyncio.sleep(0)
+            d._set_value('a', 5)
+            return await task, await d.aget('b'), await d.aget('c')
+        self.assertEqual(asyncio.run(set_while_awaited()), (4, 6, 30))
+        with self.assertRaises(RuntimeError):
+            dag(a=3).c
+
+class TestCache(unittest.TestCase):
+    def test_memory_cache(self):
+        from lazydag.cache import MemoryCache
+        from lazydag.plan import Empty
+        cache = MemoryCache(max_bytes=250)
+        for i in range(3):
+            cache.put(i, b'x' * 100)
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get(0), Empty)
+        self.assertEqual(cache.get(1), b'x' * 100)
+        cache.put(3, b'y' * 100) # `2` is the least recently used
+        self.assertIs(cache.get(2), Empty)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        cache = MemoryCache(max_age=0)
+        cache.put(0, 1)
+        self.assertIs(cache.get(0), Empty)
+
+    def test_cached(self):
+        import tempfile
+        from lazydag import LazyDAG
+        from lazydag.cache import Cache, DirectoryCache, cached
+        from lazydag.lazyclass import lazyclass
+
+        calls = []
+        with tempfile.TemporaryDirectory() as path:
+            def make_class(cache):
+                @lazyclass
+                class A:
+                    @cached(cache)
+                    def c__d(a, b):
+                        calls.append((a, b))
+                        return a + b, a - b
+                return A
+            cache = DirectoryCache(path)
+            A = make_class(cache)
+            self.assertEqual((A(a=3, b=1).c, A(a=3, b=1).d), (4, 2))
+            self.assertEqual(calls, [(3, 1)])
+
+            # another cache on the same directory, as in another process
+            cache = DirectoryCache(path, max_bytes=10**6)
+            A = make_class(cache)
+            self.assertEqual(A(a=3, b=1).d, 2)
+            self.assertEqual(A(a=4, b=1).d, 3)
+            self.assertEqual(calls, [(3, 1), (4, 1)])
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            dag = LazyDAG()
+            @dag.edge
+            @cached(cache, version=1)
+            def e(a):
+                calls.append(a)
+                return [a]
+            self.assertEqual(dag(a=5).e, [5])
+            self.assertEqual(dag(a=5).e, [5])
+            self.assertEqual(calls[2:], [5])
+
+            DirectoryCache(path, max_bytes=0).put('x', 0)
+            self.assertEqual(os.listdir(path), [])
+
+            # the directory is scanned once, then only when the size put since exceeds `max_bytes`
+            cache = DirectoryCache(path, max_bytes=1000)
+            cache.put('x', b'x' * 400)
+            os.utime(os.path.join(path, 'x.pkl'), (0, 0))
+            self.assertLess(cache.nbytes, 500)
+            cache.put('y', b'y' * 400)
+            self.assertLess(cache.nbytes, 1000)
+            self.assertEqual(sorted(os.listdir(path)), ['x.pkl', 'y.pkl'])
+            cache.put('z', b'z' * 400)
+            self.assertEqual(sorted(os.listdir(path)), ['y.pkl', 'z.pkl'])
+
+            # a file evicted by another process while read is a miss
+            from unittest import mock
+            from lazydag.plan import Empty
+            cache = DirectoryCache(path)
+            cache.put('w', 1)
+            utime = os.utime
+            def evicted(filename, *args):
+                os.remove(filename)
+                utime(filename, *args)
+            with mock.patch('os.utime', evicted):
+                self.assertIs(cache.get('w'), Empty)
+            self.assertEqual(cache.misses, 1)
+
+        # a cache without `put`
+        class Incomplete(Cache):
+            def get(self, key):
+                return None
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+class TestProfile(unittest.TestCase):
+    def test_profiling(self):
+        import json
+        import tempfile
+        from lazydag import plan
+        from lazydag.cache import MemoryCache, cached
+        from lazydag.lazyclass import lazyclass
+        from lazydag.profile import profiling
+
+        @lazyclass
+        class A:
+            def b(a):
+                return bytes(a)
+            @cached(MemoryCache())
+            def c(b):
+                return len(b)
+            def d(b, c):
+                return c * 2
+        obj = A(a=100)
+        obj.d
+        with profiling() as profiler:
+            obj.set(a=200)
+            self.assertEqual(obj.d, 400)
+            A(a=200).d
+        self.assertIsNone(plan._profiler)
+
+        stats = {s.name: s for s in profiler.stats.values()}
+        self.assertEqual((stats['b'].calls, stats['c'].calls, stats['d'].calls), (2, 2, 2))
+        self.assertEqual(stats['c'].cache_hits, 1)
+        self.assertEqual(stats['b'].bytes, 200)
+        self.assertEqual(stats['d'].invalidations, 1)
+        self.assertGreaterEqual(stats['d'].wall_inclusive, stats['b'].wall + stats['d'].wall)
+        self.assertEqual(profiler.summary().splitlines()[0].split()[0], 'node')
+
+        with tempfile.TemporaryDirectory() as path:
+            profiler.dump_chrome_trace(os.path.join(path, 'trace.json'))
+            with open(os.path.join(path, 'trace.json')) as f:
+                events = json.load(f)['traceEvents']
+        self.assertEqual(sorted(e['name'] for e in events), ['b', 'b', 'c', 'c', 'd', 'd'])
+
+        # the same inclusive times when computed without pulling the args
+        with profiling() as profiler:
+            A(a=300).compute('d')
+        stats = {s.name: s for s in profiler.stats.values()}
+        self.assertGreaterEqual(stats['d'].wall_inclusive, stats['b'].wall + stats['c'].wall + stats['d'].wall)
+        self.assertGreaterEqual(stats['c'].wall_inclusive, stats['c'].wall)
+        self.assertLess(stats['c'].wall_inclusive, stats['d'].wall_inclusive)
+
+        # the nodes of the same name in different classes are told apart
+        @lazyclass
+        class B:
+            def c(a):
+                return a
+        with profiling() as profiler:
+            A(a=1).c, B(a=1).c
+        self.assertEqual(sorted((s.name, s.calls) for s in profiler.stats.values()), [('b', 1), ('c', 1), ('c', 1)])
+        self.assertEqual(len([line for line in profiler.summary().splitlines() if line.startswith('c (')]), 2)
+
+class TestGraph(unittest.TestCase):
+    def test_graph(self):
+        import json
+        from lazydag import LazyDAG, graph
+
+        @lazyclass
+        class A:
+            def c__b(a):
+                return a + 1, a * 2
+            def d(b, c):
+                return b + c
+            def e(d):
+                return d * 2
+            def f(a):
+                return -a
+        self.assertEqual(graph.depths(A), {'a': 0, 'b': 1, 'c': 1, 'd': 2, 'e': 3, 'f': 1})
+        self.assertEqual(set(graph.invalidates(A, 'a')), set('bcdef'))
+        self.assertEqual(graph.computes(A, 'e'), ['c__b', 'd', 'e'])
+
+        obj = A(a=1)
+        obj.d
+        self.assertEqual(set(graph.invalidates(obj, 'a')), set('bcd'))
+        self.assertEqual(graph.computes(obj, 'e'), ['e'])
+        obj.a = 2
+        self.assertEqual(graph.invalidates(obj, 'a'), [])
+        self.assertEqual(graph.computes(obj, 'e'), ['c__b', 'd', 'e'])
+
+        stats = {'c__b': 1., 'd': 2., 'e': 0.5, 'f': 3.}
+        self.assertEqual(graph.critical_path(A, stats), (3.5, ['c__b', 'd', 'e']))
+        data = json.loads(graph.to_json(A, stats))
+        self.assertEqual([n['name'] for n in data['nodes'] if n['fan_in'] == 2], ['d'])
+        self.assertEqual(data['critical_path'], {'seconds': 3.5, 'funcs': ['c__b', 'd', 'e']})
+        dot = graph.to_dot(A, stats)
+        self.assertIn('"func:c__b" -> "b" [color=red];', dot)
+        self.assertIn('"a" -> "func:f";', dot)
+
+        dag = LazyDAG()
+        dag.add_edge(['b'], lambda a: a, 'a')
+        self.assertEqual(graph.computes(dag(a=1), 'b'), ['b'])
+
 class TestLazyClass(unittest.TestCase):
     def test_LazyProperty(self):
         from lazydag.lazyclass import LazyProperty
@@ -224,5 +610,713 @@ class TestLazyClass(unittest.TestCase):
         dag.set(a=5)                    # reset `a`
         self.assertTrue(dag.double==16) # `sum` was calculated again in this line
 
+    def test_compute(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        from lazydag.lazyclass import lazyclass
+
+        barrier = threading.Barrier(2, timeout=5)
+        calls = []
+        @lazyclass
+        class A:
+            def x(a):
+                calls.append('x')
+                barrier.wait()
+                return a + 1
+            def y(a):
+                calls.append('y')
+                barrier.wait()
+                return a - 1
+            def z(x, y):
+                calls.append('z')
+                return x * y
+        a = A(a=3)
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(a.compute('z', 'y', executor=executor), (8, 2))
+        self.assertEqual(sorted(calls), ['x', 'y', 'z'])
+        self.assertEqual(a.compute('x'), (4,))
+
+    def test_aget(self):
+        import asyncio
+        from lazydag.lazyclass import lazyclass
+
+        calls = []
+        events = {}
+        @lazyclass
+        class A:
+            async def x(a):
+                calls.append('x')
+                await events['y'].wait()
+                return a + 1
+            async def y(a):
+                calls.append('y')
+                events['y'].set()
+                return a - 1
+            def z(x, y):
+                return x * y
+
+        async def main():
+            events['y'] = asyncio.Event()
+            a = A(a=3)
+            return await asyncio.gather(a.aget('z'), a.aget('x'))
+        # `x` waits for `y`, so they have to run concurrently
+        self.assertEqual(asyncio.run(asyncio.wait_for(main(), 5)), [8, 4])
+        self.assertEqual(sorted(calls), ['x', 'y'])
+
+    def test_cutoff(self):
+        from lazydag.lazyclass import lazyclass, LazyProperty
+
+        calls = []
+        @lazyclass(eq=True)
+        class A:
+            def b(a):
+                calls.append('b')
+                return a % 2
+            def c(b):
+                calls.append('c')
+                return b * 10
+            @LazyProperty(eq=lambda old, new: abs(old - new) < 1)
+            def d(c, e):
+                calls.append('d')
+                return c + e
+            def f(d):
+                calls.append('f')
+                return -d
+        a = A(a=1, e=0.5)
+        self.assertEqual(a.f, -10.5)
+        self.assertEqual(calls, ['b', 'c', 'd', 'f'])
+
+        # same value: nothing is run again
+        calls.clear()
+        a.set(a=1)
+        self.assertEqual(a.f, -10.5)
+        self.assertEqual(calls, [])
+
+        # `b` does not change, so `c` and below are not run again
+        a.set(a=3)
+        self.assertEqual(a.f, -10.5)
+        self.assertEqual(calls, ['b'])
+
+        # `d` is close enough to its old value, so `f` is not run again
+        calls.clear()
+        a.set(e=0.7)
+        self.assertEqual(a.f, -10.5)
+        self.assertEqual(a.d, 10.5)
+        self.assertEqual(calls, ['d'])
+
+        calls.clear()
+        a.set(a=2)
+        self.assertEqual(a.f, -0.7)
+        self.assertEqual(calls, ['b', 'c', 'd', 'f'])
+
+    def test_free(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from lazydag.lazyclass import lazyclass
+        from lazydag.plan import Empty
+
+        live = []
+        @lazyclass
+        class A:
+            def b(a):
+                return [a] * 3
+            def c__x(b):
+                return [v + 1 for v in b], 0
+            def d(c, b):
+                live.append(freed(obj, 'b', 'c', 'x'))
+                return sum(c) + len(b)
+            def e(d):
+                live.append(freed(obj, 'b', 'c', 'x'))
+                return d * 2
+        def freed(obj, *names):
+            state = obj.__lazy_state__
+            return [k for k in names if state.values[state.plan.index[k]] is Empty]
+
+        obj = A(a=1)
+        self.assertEqual(obj.compute('e', free=True), (18,))
+        # `x` has no consumer, `b` and `c` are freed after `d`
+        self.assertEqual(live, [['x'], ['b', 'c', 'x']])
+        self.assertEqual(freed(obj, 'b', 'c', 'd', 'x'), ['b', 'c', 'd', 'x'])
+
+        # freed values are computed again after a change
+        obj.set(a=2)
+        live.clear()
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(obj.compute('e', executor=executor, free=True, pin=['c']), (24,))
+        self.assertEqual(freed(obj, 'b', 'c', 'd', 'x'), ['b', 'd', 'x'])
+        self.assertEqual(obj.c, [3, 3, 3])
+
+        # a consumer only starts once its stale args are computed again
+        import time
+        @lazyclass
+        class B:
+            def c__b(a):
+                return a, a * 10
+            def x(y):
+                time.sleep(0.05)
+                return y
+            def d(c, y):
+                return c + y
+            def e(b, x):
+                return b + x
+        obj = B(a=1, y=1)
+        obj.compute('d', 'e', 'b', free=True)
+        obj.y = 2
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(obj.compute('d', 'e', executor=executor), (3, 12))
+        self.assertEqual(obj.e, 12)
+
+    def test_published(self):
+        from lazydag.lazyclass import lazyclass
+
+        @lazyclass
+        class A:
+            def b(a):
+                return a * 2
+            def c(b):
+                return b + 1
+        obj = A(a=1)
+        self.assertEqual(obj.c, 3)
+        self.assertEqual(obj.__dict__['c'], 3)
+        self.assertNotIn('b', obj.__dict__)
+
+        # values are removed from `__dict__` when invalidated
+        obj.a = 2
+        self.assertNotIn('c', obj.__dict__)
+        self.assertEqual(obj.c, 5)
+        self.assertEqual((obj.a, obj.b), (2, 4))
+        obj.set(a=3)
+        self.assertEqual([k for k in 'abc' if k in obj.__dict__], [])
+        self.assertEqual(obj.c, 7)
+        with self.assertRaises(RuntimeError):
+            obj.c = 1
+
+        # other attributes are set as usual
+        obj.other = 1
+        self.assertEqual(obj.__dict__['other'], 1)
+
+    def test_process_pool(self):
+        import glob
+        from lazydag import LazyDAG
+        from lazydag.plan import Empty
+        from lazydag.process import ProcessPool
+
+        obj = _Pipeline(n=64)
+        with ProcessPool(2, min_shared_bytes=1024) as pool:
+            self.assertEqual(obj.compute('summary', executor=pool), ((32512 * 64, 256 * 64),))
+            # `doubled` and `total` are run as a chain, whose inside is not kept
+            state = obj.__lazy_state__
+            self.assertIs(state.values[state.plan.index['doubled']], Empty)
+            self.assertEqual(obj.data, bytearray(range(256)) * 64)
+            obj.n = 2
+            self.assertEqual(obj.compute('summary', 'doubled', executor=pool),
+                             ((32512 * 2, 512), bytearray(2 * x % 256 for x in range(256)) * 2))
+            self.assertEqual(obj.total, 32512 * 2)
+
+            dag = LazyDAG()
+            dag.add_edge(['b'], _increment, 'a')
+            dag.add_edge(['c'], _increment, 'b')
+            self.assertEqual(dag(a=1).compute('c', executor=pool), (3,))
+            dag.add_edge(['d'], lambda c: c, 'c')
+            with self.assertRaises(RuntimeError):
+                dag(a=1).compute('d', executor=pool)
+        self.assertEqual(glob.glob('/dev/shm/lazydag-*'), [])
+
+    def test_stream(self):
+        import asyncio
+
+        @lazyclass(eq=True)
+        class Quote:
+            def mid(bid, ask):
+                return (bid + ask) / 2
+            def spread(bid, ask):
+                return ask - bid
+
+        obj = Quote(bid=99, ask=101)
+        updates = [('bid', 100), {'bid': 99, 'ask': 103}, ('ask', 102), ('bid', 98)]
+        self.assertEqual(list(obj.stream(updates, ['mid', 'spread'])), [
+            {'mid': 100, 'spread': 2},
+            {'mid': 100.5, 'spread': 1},
+            {'mid': 101, 'spread': 4},
+            {'mid': 100.5, 'spread': 3},
+            {'mid': 100, 'spread': 4},
+        ])
+        # coalesced updates: `mid` is unchanged after the first two
+        obj = Quote(bid=99, ask=101)
+        self.assertEqual(list(obj.stream([('bid', 98), ('ask', 102), ('ask', 104)], ['mid', 'spread'], coalesce=2)),
+                         [{'mid': 100, 'spread': 2}, {'spread': 4}, {'mid': 101, 'spread': 6}])
+
+        async def ticks():
+            for update in updates:
+                yield update
+        async def collect(**kwargs):
+            obj = Quote(bid=99, ask=101)
+            return [changes async for changes in obj.astream(ticks(), ['mid'], **kwargs)]
+        self.assertEqual(asyncio.run(collect()), [{'mid': 100}, {'mid': 100.5}, {'mid': 101}, {'mid': 100.5}, {'mid': 100}])
+        # all the updates are coalesced, after which `mid` is unchanged
+        self.assertEqual(asyncio.run(collect(coalesce=10, latency=1)), [{'mid': 100}])
+
+        # without `eq`, the values computed again are compared to the ones yielded
+        @lazyclass
+        class Parity:
+            def b(a):
+                return a % 2
+        self.assertEqual(list(Parity(a=1).stream([('a', 3), ('a', 4), ('a', 6), ('a', 7)], ['b'])),
+                         [{'b': 1}, {'b': 0}, {'b': 1}])
+
+        # the lazy properties named as the added methods are kept
+        @lazyclass
+        class B:
+            def stream(a):
+                return a + 1
+            def compute(a):
+                return a * 2
+            def aget(a):
+                return -a
+        obj = B(a=1)
+        self.assertEqual((obj.stream, obj.compute, obj.aget), (2, 2, -1))
+        self.assertEqual(obj.set(a=2).stream, 3)
+        self.assertTrue(callable(obj.astream))
+
+    def test_snapshot(self):
+        import pickle
+        import tempfile
+        from lazydag import snapshot
+
+        calls = []
+        @lazyclass
+        class A:
+            def b(a):
+                calls.append('b')
+                return pickle.PickleBuffer(bytearray([1]) * a)
+            def c(b):
+                calls.append('c')
+                return sum(b.raw())
+            def d(a):
+                calls.append('d')
+                return -a
+
+        obj = A(a=1000)
+        self.assertEqual((obj.c, obj.d), (1000, -1000))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'obj.lazydag')
+            snapshot.save(obj, path)
+            calls.clear()
+            restored = snapshot.load(A(), path)
+            self.assertEqual((restored.a, restored.c, restored.d), (1000, 1000, -1000))
+            # the buffers are mapped from the file
+            self.assertIsInstance(restored.b, memoryview)
+            self.assertEqual(calls, [])
+
+            # the values of changed funcs and the ones after them are dropped
+            @lazyclass
+            class A:
+                def b(a):
+                    calls.append('b')
+                    return pickle.PickleBuffer(bytearray([2]) * a)
+                def c(b):
+                    calls.append('c')
+                    return sum(b.raw())
+                def d(a):
+                    calls.append('d')
+                    return -a
+            restored = snapshot.load(A(), path)
+            self.assertEqual((restored.c, restored.d), (2000, -1000))
+            self.assertEqual(calls, ['b', 'c'])
+
+            # the successors of the values which could not be pickled are still invalidated
+            @lazyclass
+            class B:
+                def b(a):
+                    return lambda: a
+                def c(b):
+                    return b() * 10
+            obj = B(a=1)
+            self.assertEqual(obj.c, 10)
+            snapshot.save(obj, path)
+            restored = snapshot.load(B(), path)
+            self.assertEqual(restored.c, 10)
+            restored.a = 2
+            self.assertEqual(restored.c, 20)
+
+    def test_threadsafe(self):
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+
+        calls = []
+        @lazyclass(threadsafe=True)
+        class A:
+            def b(a):
+                calls.append('b')
+                time.sleep(0.05)
+                return a * 2
+            def c(b):
+                return b + 1
+            def slow__x(a):
+                time.sleep(0.1)
+                return a, a
+            def y(a):
+                time.sleep(0.1)
+                return a
+            def z(a):
+                time.sleep(0.1)
+                return a
+
+        # the readers of a property being computed wait for it
+        obj = A(a=1)
+        with ThreadPoolExecutor(8) as executor:
+            self.assertEqual(list(executor.map(lambda _: obj.c, range(8))), [3] * 8)
+        self.assertEqual(calls, ['b'])
+
+        # the reads of different properties run concurrently
+        obj = A(a=1)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(3) as executor:
+            self.assertEqual(list(executor.map(lambda name: getattr(obj, name), ['x', 'y', 'z'])), [1] * 3)
+        self.assertLess(time.perf_counter() - start, 0.25)
+
+        # stress: reads concurrent with sets never return a stale value once set
+        obj = A(a=0)
+        stop = threading.Event()
+        errors = []
+        def read():
+            while not stop.is_set():
+                a = obj.a
+                c = obj.c
+                if c < 2 * a + 1:
+                    errors.append((a, c))
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for thread in readers:
+            thread.start()
+        for i in range(1, 20):
+            obj.a = i
+            time.sleep(0.005)
+        stop.set()
+        for thread in readers:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(obj.c, 2 * 19 + 1)
+
+        # so do the concurrent computes and reads
+        calls.clear()
+        obj = A(a=1)
+        with ThreadPoolExecutor(5) as executor:
+            results = [executor.submit(obj.compute, 'b') for _ in range(4)] + [executor.submit(lambda: obj.b)]
+            self.assertEqual([f.result() for f in results], [(2,)] * 4 + [2])
+        self.assertEqual(calls, ['b'])
+
+        # a value set while computed by an executor makes it run again
+        calls.clear()
+        obj = A(a=1)
+        with ThreadPoolExecutor(2) as pool, ThreadPoolExecutor(1) as executor:
+            future = executor.submit(obj.compute, 'b', executor=pool)
+            while not calls:
+                time.sleep(0.001)
+            obj.a = 10
+            future.result()
+        self.assertEqual(obj.b, 20)
+
+    def test_deep(self):
+        from lazydag import LazyDAG
+        from lazydag.lazyclass import lazyclass
+
+        n = 3000
+        namespace = {}
+        for i in range(1, n + 1):
+            exec(f'def v{i}(v{i-1}):\n    return v{i-1} + 1', namespace)
+        A = lazyclass(type('A', (), {f'v{i}': namespace[f'v{i}'] for i in range(1, n + 1)}))
+        obj = A(v0=0)
+        self.assertEqual(obj.compute(f'v{n}', 'v1'), (n, 1))
+        obj.v0 = 1
+        self.assertEqual(obj.compute(f'v{n}'), (n + 1,))
+
+        dag = LazyDAG(v0=0)
+        for i in range(1, n + 1):
+            dag.add_edge([f'v{i}'], lambda x: x + 1, f'v{i-1}')
+        self.assertEqual(dag(v0=1).compute(f'v{n}'), (n + 1,))
+
+    def test_compiled(self):
+        from lazydag import LazyDAG
+        from lazydag.lazyclass import lazyclass
+
+        calls = []
+        @lazyclass(compiled=True, eq=True)
+        class A:
+            def b(a):
+                calls.append('b')
+                return a % 2
+            def c__d(b, a):
+                calls.append('cd')
+                return b * 10, a
+            def e(c, d=None):
+                calls.append('e')
+                return c + d
+        obj = A(a=1)
+        self.assertEqual((obj.e, obj.c, obj.d), (11, 10, 1))
+        self.assertEqual(calls, ['b', 'cd', 'e'])
+        # one evaluator for the plan, shared by the instances
+        plan = A.__dict__['__lazy_plan__']
+        evaluator = plan.evaluator()
+        self.assertEqual(evaluator.source.count('(values, changed, verified, dirty, revision):'), 3)
+        self.assertEqual(A(a=2).e, 2)
+        self.assertEqual(A(a=2).compute('d', 'b'), (2, 0))
+        self.assertIs(plan.evaluator(), evaluator)
+        self.assertEqual([key for key in plan.derived if key[0] == 'codegen'], [('codegen',)])
+
+        # the nodes too deep to be computed by recursion
+        namespace = {}
+        for i in range(1, 1500):
+            exec(f'def v{i}(v{i-1}): return v{i-1} + 1', namespace)
+        Chain = lazyclass(type('Chain', (), namespace), compiled=True)
+        chain = Chain(v0=1)
+        self.assertEqual((chain.v1499, chain.v1000), (1500, 1001))
+        chain.v0 = 2
+        self.assertEqual(chain.compute('v1000', 'v1499'), (1002, 1501))
+
+        # early cutoff and re-verification as without `compiled`
+        calls.clear()
+        obj.a = 3
+        self.assertEqual(obj.compute('e', 'b'), (13, 1))
+        self.assertEqual(calls, ['b', 'cd', 'e'])
+        calls.clear()
+        obj.set(a=3)
+        self.assertEqual(obj.e, 13)
+        self.assertEqual(calls, [])
+        self.assertEqual(obj.compute('e', compiled=False), (13,))
+        with self.assertRaises(AttributeError):
+            A().e
+
+        dag = LazyDAG(a=1)
+        dag.add_edge(['b'], lambda a: a + 1, 'a')
+        dag.add_edge(['c'], lambda a, b: a * b, b='b', a='a')
+        self.assertEqual(dag(a=2).compute('c', 'b', compiled=True), (6, 3))
+        self.assertEqual(dag(a=3).compute('c', 'b', compiled=True), (12, 4))
+
+    def test_outputs(self):
+        from lazydag.lazyclass import lazy_property, lazyclass
+
+        for compiled in (False, True):
+            calls = []
+            config = {'scale': 10}
+            @lazyclass(compiled=compiled)
+            class A:
+                def config__scaled(a):
+                    calls.append('config__scaled')
+                    return config, a * config['scale']
+                @lazy_property(eq={'parity': True})
+                def parity__half(a):
+                    calls.append('parity__half')
+                    return a % 2, a // 2
+                def scale(config):
+                    calls.append('scale')
+                    return config['scale']
+                def odd(parity):
+                    calls.append('odd')
+                    return parity == 1
+                def total(scaled, half):
+                    calls.append('total')
+                    return scaled + half
+            obj = A(a=3)
+            self.assertEqual(obj.compute('scale', 'odd', 'total'), (10, True, 31))
+            calls.clear()
+            # `config` is the same object and `parity` is equal, only `total` is run again
+            obj.a = 5
+            self.assertEqual(obj.compute('scale', 'odd', 'total'), (10, True, 52))
+            self.assertEqual(sorted(calls), ['config__scaled', 'parity__half', 'total'])
+            self.assertEqual(A.__dict__['__lazy_plan__'].names.count('parity__half'), 0)
+
+        @lazyclass
+        class B(A):
+            def double(total):
+                return total * 2
+        self.assertEqual(set(B.__dict__['__lazy_plan__'].names),
+                         {'a', 'config', 'scaled', 'parity', 'half', 'scale', 'odd', 'total', 'double'})
+        self.assertEqual(B(a=1).double, 20)
+
+    def test_startup(self):
+        import subprocess
+        import sys
+        import lazydag
+        from lazydag.plan import func_args
+
+        # the submodules not used are not imported
+        code = ('import sys; from lazydag.lazyclass import lazyclass; '
+                'print(sorted(m for m in ["asyncio", "concurrent.futures", "dataclasses", "inspect", '
+                '"lazydag.lazydag", "lazydag.batch"] if m in sys.modules))')
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.stdout.strip(), '[]')
+        self.assertIs(lazydag.LazyDAG, lazydag.lazydag.LazyDAG)
+        self.assertIn('vectorized', dir(lazydag))
+        with self.assertRaises(AttributeError):
+            lazydag.missing
+
+        # the args of a func are found once, for all the classes using it
+        def c(a, b, *args, d=1):
+            return a + b
+        self.assertEqual(func_args(c), ['a', 'b'])
+        self.assertIs(func_args(c), func_args(c))
+        self.assertEqual(func_args(lazydag.vectorized(max)), [])
+
+        @lazyclass
+        class A:
+            def b(a):
+                return a + 1
+        @lazyclass
+        class B(A):
+            def c(b):
+                return b * 2
+        @lazyclass
+        class C(B):
+            def d(a, c):
+                return a + c
+        plan = C.__dict__['__lazy_plan__']
+        self.assertEqual([plan.names[plan.nodes[n].returns[0]] for n in plan.order], ['b', 'c', 'd'])
+        self.assertEqual(C(a=1).d, 5)
+
+    def test_deferred(self):
+        from lazydag import graph
+        from lazydag.lazyclass import lazyclass
+
+        for compiled in (False, True):
+            calls = []
+            @lazyclass(deferred=True, eq=True, compiled=compiled)
+            class A:
+                def b(a):
+                    calls.append('b')
+                    return a % 2
+                def c(b, x):
+                    calls.append('c')
+                    return b + x
+                def d(x):
+                    calls.append('d')
+                    return x * 10
+            obj = A(a=1, x=1)
+            self.assertEqual((obj.c, obj.d), (2, 10))
+            state = obj.__lazy_state__
+            self.assertEqual(vars(obj), {'__lazy_state__': state})
+            self.assertEqual(graph.invalidates(obj, 'a'), ['b', 'c'])
+
+            # the successors are not walked when set, but verified when read
+            calls.clear()
+            for i in range(3, 100, 2):
+                obj.a = i
+            self.assertEqual(state.revision, 50)
+            self.assertEqual(obj.c, 2)
+            self.assertEqual(calls, ['b'])
+            obj.x = 2
+            self.assertEqual(obj.compute('c', 'd'), (3, 20))
+            self.assertEqual(calls, ['b', 'c', 'd'])
+            obj.a = 0
+            self.assertEqual((obj.d, obj.c), (20, 2))
+            self.assertEqual(calls, ['b', 'c', 'd', 'b', 'c'])
+
+    def test_batch(self):
+        from lazydag.lazyclass import lazyclass
+
+        calls = []
+        @lazyclass
+        class A:
+            def c(a, b):
+                calls.append('c')
+                return a + b
+        obj = A(a=1, b=2)
+        self.assertEqual(obj.c, 3)
+        state = obj.__lazy_state__
+        revision = state.revision
+        obj.set(a=2, b=3)
+        self.assertEqual(state.revision, revision + 1)
+        self.assertEqual(obj.c, 5)
+
+        # nothing is set if one of the vars can not be
+        with self.assertRaises(RuntimeError):
+            obj.set(a=0, c=0)
+        self.assertEqual((obj.a, obj.c), (2, 5))
+
+        # the assignments of a batch are applied at its end
+        with obj.batch():
+            obj.a = 10
+            obj.b = 20
+            self.assertEqual(obj.c, 5)
+        self.assertEqual(obj.c, 30)
+        with self.assertRaises(ValueError):
+            with obj.batch():
+                obj.a = 0
+                raise ValueError
+        self.assertEqual(obj.c, 30)
+        self.assertEqual(calls, ['c'] * 3)
+
+        # a lazy property named `batch` is not replaced by the method
+        @lazyclass
+        class B:
+            def batch(data):
+                return data[:2]
+            def loss(batch):
+                return sum(batch)
+        self.assertEqual(B(data=[1, 2, 3]).loss, 3)
+
+    def test_slots(self):
+        from lazydag.lazyclass import lazyclass
+
+        @lazyclass(slots=True)
+        class A:
+            def b(a):
+                return a * 2
+            def c(b):
+                return b + 1
+        obj = A(a=1)
+        self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertEqual(obj.c, 3)
+        obj.a = 2
+        self.assertEqual(obj.c, 5)
+        with self.assertRaises(AttributeError):
+            obj.other = 1
+
+        @lazyclass(slots=True)
+        class B(A):
+            def d(c):
+                return -c
+        self.assertEqual(B.__slots__, ())
+        self.assertEqual(B(a=1).d, -3)
+
+        # the methods calling `super()` refer to the new class
+        class Base:
+            def describe(self):
+                return 'base'
+        @lazyclass(slots=True)
+        class C(Base):
+            def b(a):
+                return a * 2
+            def describe(self):
+                return 'c of ' + super().describe()
+        self.assertEqual((C(a=1).describe(), C(a=1).b), ('c of base', 2))
+
+    def test_plan(self):
+        from lazydag.lazyclass import lazyclass
+
+        @lazyclass
+        class A:
+            def b(a):
+                return a * 2
+            def c(a, b):
+                return a + b
+        plan = A.__dict__['__lazy_plan__']
+        self.assertEqual([plan.names[plan.nodes[n].returns[0]] for n in plan.order], ['b', 'c'])
+
+        x, y = A(a=1), A(a=2)
+        self.assertIs(x.__lazy_state__.plan, y.__lazy_state__.plan)
+        self.assertEqual((x.c, y.c), (3, 6))
+        # only the state and the computed values are held by instances
+        self.assertEqual(vars(x), {'__lazy_state__': x.__lazy_state__, 'c': 3})
+
+        # cycles are found when the class is decorated
+        with self.assertRaises(RuntimeError):
+            @lazyclass
+            class B:
+                def b(c):
+                    return c
+                def c(b):
+                    return b
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file